@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def component(factory):
+    # Свойство, которое создаёт компонент при первом обращении и запоминает время создания.
+    # В timings попадает только собственное время: зависимости, созданные по ходу, учитываются отдельно
+    name = factory.__name__
+
+    @functools.wraps(factory)
+    def getter(self):
+        try:
+            return self._components[name]
+        except KeyError:
+            pass
+        started = time.perf_counter()
+        nested, self._nested = self._nested, 0.0
+        try:
+            value = self._components[name] = factory(self)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = elapsed - self._nested
+            self._nested = nested + elapsed
+        return value
+
+    return property(getter)
+
+
+class Application:
+    """Компоненты бота, создаваемые при первом обращении.
+
+    Импорт aiogram и остальных тяжёлых модулей откладывается до момента,
+    когда компонент действительно нужен, поэтому import main ничего не
+    открывает и не создаёт. Запуск и остановка описываются хуками
+    (add_hook): хуки одной стадии выполняются параллельно, стадии — по
+    порядку, остановка — в обратном порядке. Время создания компонентов и
+    выполнения хуков собирается в timings.
+    """
+
+    def __init__(self, bot=None, db_path: str = "users.db"):
+        self.db_path = db_path
+        self.timings = {}
+        self._components = {}
+        if bot is not None:
+            self._components["bot"] = bot
+        self._nested = 0.0
+        self._hooks = []
+        self._started = []
+        self._spawned = set()
+
+    # --- Компоненты ---
+
+    @component
+    def db(self):
+        import metrics
+        from database import Database
+
+        db = Database(self.db_path, cache_size=config.USER_CACHE_SIZE, cache_ttl=config.USER_CACHE_TTL)
+        metrics.register_user_cache(db.cache)
+        return db
+
+    @component
+    def bot(self):
+        from aiogram import Bot
+
+        return Bot(token=config.BOT_TOKEN)
+
+    @component
+    def storage(self):
+        # Хранилище состояний FSM выбирается в config.FSM_STORAGE
+        if config.FSM_STORAGE == "redis":
+            from aiogram.fsm.storage.redis import RedisStorage  # Требует пакет redis
+            return RedisStorage.from_url(config.REDIS_URL, state_ttl=config.FSM_STATE_TTL, data_ttl=config.FSM_STATE_TTL)
+        if config.FSM_STORAGE == "memory":
+            from aiogram.fsm.storage.memory import MemoryStorage
+            return MemoryStorage()
+        from fsm_storage import SQLiteStorage
+        return SQLiteStorage(self.db, ttl=config.FSM_STATE_TTL)
+
+    @component
+    def dp(self):
+        from aiogram import Dispatcher
+
+        import handlers
+        import metrics
+
+        dp = Dispatcher(storage=self.storage)
+        # Обработчики получают приложение параметром app
+        dp["app"] = self
+        dp.include_router(handlers.create_router())
+        metrics.setup_dispatcher(dp)
+        return dp
+
+    @component
+    def sender(self):
+        # Все рассылки и уведомления идут через общую очередь с ограничением скорости
+        import metrics
+        from sender import OutboundSender
+
+        sender = OutboundSender(
+            self.bot,
+            self.db,
+            workers=config.SEND_WORKERS,
+            global_rate=config.SEND_RATE_GLOBAL,
+            per_chat_rate=config.SEND_RATE_PER_CHAT,
+        )
+        metrics.register_sender(sender)
+        return sender
+
+    @component
+    def outbox(self):
+        # Уведомления, записанные в базу вместе с изменениями подписок
+        from outbox import NotificationOutbox
+
+        return NotificationOutbox(self.db, self.sender)
+
+    @component
+    def scheduler(self):
+        # Планировщик напоминаний об окончании подписок
+        import handlers
+        from scheduler import ReminderScheduler
+
+        return ReminderScheduler(self.db, handlers.reminder_text, functools.partial(handlers.handle_reminders, self),
+                                 self.outbox, chunk_size=config.EXPIRY_CHUNK_SIZE)
+
+    @component
+    def revoker(self):
+        # Очередь удаления пользователей из каналов
+        import handlers
+        from revocation import MemberRevoker
+
+        return MemberRevoker(self.bot, self.db, concurrency=config.REVOKE_CONCURRENCY,
+                             on_result=functools.partial(handlers.handle_revocation, self))
+
+    @component
+    def leader(self):
+        # Планировщик и удаление из каналов работают только в одном процессе — лидере
+        from leader import LeaderElection
+
+        return LeaderElection(self.db, "scheduler", ttl=config.LEADER_LOCK_TTL)
+
+    @component
+    def digest(self):
+        # Сводка для администраторов вместо сообщения на каждое событие; отправляет её лидер
+        import handlers
+        from digest import AdminDigest
+
+        return AdminDigest(
+            self.db,
+            self.sender,
+            config.ADMIN_IDS,
+            interval=config.ADMIN_DIGEST_INTERVAL,
+            max_events=config.ADMIN_DIGEST_MAX_EVENTS,
+            alert_amount=config.ADMIN_ALERT_AMOUNT * 100,
+            on_alert=functools.partial(handlers.notify_admin, self),
+            is_sender=lambda: self.leader.is_leader,
+        )
+
+    @component
+    def update_processor(self):
+        from update_processor import UpdateProcessor
+
+        return UpdateProcessor(self.dp, self.bot, workers=config.UPDATE_WORKERS)
+
+    @component
+    def webhook_app(self):
+        # Webhook-сервер ЮКассы (и Telegram в режиме webhook) работает в том же event loop, что и бот
+        from webhook_server import create_app
+
+        return create_app(self.bot, self.db, self.digest)
+
+    async def run_leader_tasks(self):
+        # Если один из циклов упал, остальные отменяются: LeaderElection перезапустит
+        # их все вместе, и у лидера не окажется двух копий одного цикла
+        tasks = [asyncio.ensure_future(coro) for coro in (self.scheduler.run(), self.outbox.run(), self.revoker.run())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Запуск и остановка ---
+
+    def add_hook(self, name: str, start=None, stop=None, stage: int = 0):
+        # start и stop — функции без аргументов, обычные или асинхронные
+        self._hooks.append((stage, name, start, stop))
+
+    def add_task(self, name: str, coroutine_factory, stage: int = 0):
+        # Фоновая задача на всё время работы: создаётся при запуске, отменяется при остановке
+        tasks = []
+
+        def start():
+            tasks.append(asyncio.create_task(coroutine_factory()))
+
+        async def stop():
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.add_hook(name, start, stop, stage)
+
+    def add_webhook_server(self, updates=None, stage: int = 0, sender=None):
+        # updates — получатель апдейтов Telegram в режиме webhook (UpdateProcessor или ShardRouter);
+        # sender — запущенная очередь отправки для уведомлений об оплате, без неё они идут через бота
+        from webhook_server import add_telegram_route, create_ssl_context, start_webhook_server
+
+        runners = []
+
+        async def start():
+            self.webhook_app['sender'] = sender
+            if updates is not None:
+                add_telegram_route(self.webhook_app, updates, config.TELEGRAM_WEBHOOK_PATH, config.TELEGRAM_WEBHOOK_SECRET)
+            runners.append(await start_webhook_server(
+                self.webhook_app,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                ssl_context=create_ssl_context(config.WEBHOOK_SSL_CERT, config.WEBHOOK_SSL_KEY),
+            ))
+
+        async def stop():
+            for runner in runners:
+                await runner.cleanup()
+
+        self.add_hook("webhook_server", start, stop, stage)
+
+    def spawn(self, coroutine):
+        # Долгая операция, начатая обработчиком (импорт, рассылка): не занимает воркер
+        # апдейтов и отменяется при остановке до того, как остановятся база и отправка
+        task = asyncio.create_task(coroutine)
+        self._spawned.add(task)
+        task.add_done_callback(self._spawned.discard)
+        return task
+
+    async def _call(self, key: str, func):
+        if func is None:
+            return
+        started = time.perf_counter()
+        try:
+            result = func()
+            if inspect.isawaitable(result):
+                await result
+        finally:
+            self.timings[key] = time.perf_counter() - started
+
+    async def start(self):
+        for stage in sorted({hook[0] for hook in self._hooks}):
+            hooks = [hook for hook in self._hooks if hook[0] == stage]
+            results = await asyncio.gather(
+                *(self._call(f"start:{name}", start) for _, name, start, _ in hooks), return_exceptions=True
+            )
+            errors = []
+            for hook, result in zip(hooks, results):
+                if isinstance(result, BaseException):
+                    errors.append(result)
+                else:
+                    self._started.append(hook)
+            if errors:
+                # Уже запущенное останавливаем, чтобы не оставить открытые соединения
+                await self.stop()
+                raise errors[0]
+
+    async def stop(self):
+        spawned = list(self._spawned)
+        for task in spawned:
+            task.cancel()
+        await asyncio.gather(*spawned, return_exceptions=True)
+        while self._started:
+            _, name, _, stop = self._started.pop()
+            try:
+                await self._call(f"stop:{name}", stop)
+            except Exception as e:
+                logger.error(f"Ошибка остановки {name}: {e}")
@@ -0,0 +1,108 @@
+# Массовые операции администратора на --rows пользователях:
+#   импорт CSV (/import_users) — пачки executemany в одной транзакции;
+#   продление всех подписок канала (/extend_channel) — один UPDATE;
+#   рассылка сегменту (/broadcast) — страницы id из базы в очередь отправки.
+# Для сравнения те же импорт и продление делаются по одной записи через
+# upsert_user/extend_subscription, как это пришлось бы делать без этих команд,
+# на первых --baseline-rows строках.
+#
+# Рассылка идёт через фейковую очередь отправки без ограничения скорости: с
+# настоящим Telegram её длительность определяет SEND_RATE_GLOBAL, здесь видно
+# только, сколько стоит сама выборка получателей.
+#
+# Запуск: python -m benchmarks.bulk_admin --rows 100000
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast import Broadcast  # noqa: E402
+from database import DATE_FORMAT, EXPORT_COLUMNS, Database  # noqa: E402
+
+
+class FakeSender:
+    # Сообщение «доставлено» сразу; у пользователей с id, кратным 10, бот заблокирован
+    def send_message(self, chat_id: int, text: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None if chat_id % 10 == 0 else True)
+        return future
+
+
+def write_csv(path: str, rows: int):
+    end = time.strftime(DATE_FORMAT, time.localtime(time.time() + 10 * 86400))
+    paid = time.strftime(DATE_FORMAT, time.localtime(time.time() - 20 * 86400))
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for user_id in range(1, rows + 1):
+            writer.writerow([user_id, f"user{user_id}", f"User {user_id}", "+79991234567", user_id % 2 + 1, 1, paid, end])
+
+
+async def timed(coroutine):
+    started = time.perf_counter()
+    result = await coroutine
+    return result, time.perf_counter() - started
+
+
+async def baseline(db: Database, path: str, rows: int):
+    # По одной транзакции на пользователя и на подписку
+    started = time.perf_counter()
+    with open(path, encoding="utf-8", newline="") as f:
+        for line, row in enumerate(csv.DictReader(f)):
+            if line == rows:
+                break
+            await db.upsert_user(int(row["id"]), row["username"], row["full_name"])
+            await db.set_phone(int(row["id"]), row["phone"])
+            await db.extend_subscription(int(row["id"]), int(row["channel_id"]), days=30)
+    imported = time.perf_counter() - started
+    users = await db._run("benchmark", db._fetchall,
+                          "SELECT user_id FROM subscriptions WHERE channel_id = 1 AND is_active = 1", ())
+    started = time.perf_counter()
+    for (user_id,) in users:
+        await db.extend_subscription(user_id, 1, days=3)
+    return imported, len(users), time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--baseline-rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.csv")
+        write_csv(path, args.rows)
+
+        db = Database(os.path.join(tmp, "baseline.db"))
+        await db.open()
+        imported, extended, extend_time = await baseline(db, path, args.baseline_rows)
+        await db.close()
+        print(f"по одной записи: импорт {args.baseline_rows} строк за {imported:.2f} с "
+              f"({args.baseline_rows / imported:.0f} строк/с), продление {extended} подписок за {extend_time:.2f} с "
+              f"({extended / extend_time:.0f}/с)")
+
+        db = Database(os.path.join(tmp, "bulk.db"))
+        await db.open()
+        progress = []
+        (rows, users, subscriptions), elapsed = await timed(db.import_users(path, progress.append))
+        print(f"/import_users: {rows} строк ({users} пользователей, {subscriptions} подписок) за {elapsed:.2f} с "
+              f"({rows / elapsed:.0f} строк/с), отчётов о ходе: {len(progress)}")
+
+        updated, elapsed = await timed(db.extend_channel_subscriptions(1, 3))
+        print(f"/extend_channel: {updated} подписок за {elapsed * 1000:.0f} мс")
+
+        for segment, channel in (("all", None), ("active", None), ("channel", 2), ("inactive", None)):
+            broadcast = Broadcast(db, FakeSender(), "Текст рассылки", segment, channel)
+            _, elapsed = await timed(broadcast.run())
+            print(f"/broadcast {channel or segment}: {broadcast.total} получателей за {elapsed:.2f} с, "
+                  f"отправлено {broadcast.sent}, не доставлено {broadcast.failed}")
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+# Нагрузочный тест слоя данных: N одновременных пользователей проходят
+# регистрацию и оплату. Сравнивается старый вариант (синхронный sqlite3 прямо
+# в event loop) и асинхронный Database.
+#
+# Запуск: python -m benchmarks.db_throughput --users 1000
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DATE_FORMAT, SCHEMA, Database  # noqa: E402
+
+
+async def legacy_user_flow(conn: sqlite3.Connection, user_id: int, ticks: list):
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO users (id, username, full_name) VALUES (?, ?, ?)",
+                   (user_id, f"user{user_id}", f"User {user_id}"))
+    conn.commit()
+    await asyncio.sleep(0)
+    cursor.execute("UPDATE users SET phone = ? WHERE id = ?", ("+79991234567", user_id))
+    conn.commit()
+    await asyncio.sleep(0)
+    cursor.execute("SELECT subscription_end_date_channel_1 FROM users WHERE id = ?", (user_id,))
+    cursor.fetchone()
+    new_end = (datetime.now() + timedelta(days=30)).strftime(DATE_FORMAT)
+    cursor.execute(
+        "UPDATE users SET is_paid_channel_1 = 1, payment_date_channel_1 = ?, subscription_end_date_channel_1 = ? WHERE id = ?",
+        (datetime.now().strftime(DATE_FORMAT), new_end, user_id),
+    )
+    conn.commit()
+    ticks.append(time.perf_counter())
+
+
+async def async_user_flow(db: Database, user_id: int, ticks: list):
+    await db.upsert_user(user_id, f"user{user_id}", f"User {user_id}")
+    await db.set_phone(user_id, "+79991234567")
+    await db.extend_subscription(user_id, 1, days=30)
+    ticks.append(time.perf_counter())
+
+
+async def loop_lag_probe(stop: asyncio.Event, lags: list):
+    # Насколько event loop опаздывает с пробуждением: это задержка для остальных апдейтов
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(name: str, flow, resource, users: int):
+    stop = asyncio.Event()
+    lags, ticks = [], []
+    probe = asyncio.create_task(loop_lag_probe(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(flow(resource, user_id, ticks) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    lags.sort()
+    max_lag = lags[-1] * 1000 if lags else 0.0
+    print(f"{name:>8}: {users} пользователей за {elapsed:.2f} с, "
+          f"{users * 3 / elapsed:.0f} обновлений/с, макс. задержка loop {max_lag:.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.executescript(SCHEMA)
+        await run("sqlite3", legacy_user_flow, conn, args.users)
+        conn.close()
+
+        db = Database(os.path.join(tmp, "async.db"), pool_size=args.pool_size)
+        await db.open()
+        await run("Database", async_user_flow, db, args.users)
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
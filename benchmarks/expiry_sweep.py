@@ -0,0 +1,152 @@
+# Массовое окончание подписок: ReminderScheduler записывает события пачками
+# (--chunk-size; 1 — отдельная транзакция на каждое событие), NotificationOutbox
+# доставляет уведомления через фейковую очередь отправки.
+#
+# С --crash N процесс с планировщиком N раз убивается (SIGKILL) посреди работы и
+# запускается заново на той же базе; в конце проверяется по журналу «доставленных»
+# сообщений, что каждый пользователь получил уведомление ровно один раз.
+#
+# Запуск: python -m benchmarks.expiry_sweep --users 20000
+#         python -m benchmarks.expiry_sweep --users 20000 --chunk-size 1
+#         python -m benchmarks.expiry_sweep --users 2000 --crash 5 --send-rate 500
+import argparse
+import asyncio
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from outbox import NotificationOutbox  # noqa: E402
+from scheduler import ReminderScheduler  # noqa: E402
+
+
+class FakeSender:
+    # Вместо Telegram: сообщение «доставлено», когда его chat_id записан в журнал
+    def __init__(self, rate: float, log_path: str = None):
+        self.rate = rate
+        self.delivered = Counter()
+        self._log = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT) if log_path else None
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def send_message(self, chat_id: int, text: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((chat_id, future))
+        return future
+
+    async def _worker(self):
+        while True:
+            chat_id, future = await self._queue.get()
+            if self.rate:
+                await asyncio.sleep(1 / self.rate)
+            self.delivered[chat_id] += 1
+            if self._log is not None:
+                os.write(self._log, f"{chat_id}\n".encode())
+            future.set_result(True)
+
+
+async def fill(path: str, users: int):
+    db = Database(path)
+    await db.open()
+    end_ts = int(time.time()) - 60
+    await db._run("benchmark", db._write_many, "INSERT INTO users (id, full_name) VALUES (?, ?)",
+                  [(user_id, f"User {user_id}") for user_id in range(1, users + 1)])
+    await db._run("benchmark", db._write_many,
+                  "INSERT INTO subscriptions (user_id, channel_id, is_active, payment_ts, end_ts) VALUES (?, ?, 1, ?, ?)",
+                  [(user_id, 1, end_ts - 30 * 86400, end_ts) for user_id in range(1, users + 1)])
+    await db.close()
+
+
+async def sweep(path: str, chunk_size: int, send_rate: float, log_path: str = None):
+    # Один «запуск бота»: планировщик и outbox до тех пор, пока всё не обработано и не доставлено
+    db = Database(path)
+    await db.open()
+    sender = FakeSender(send_rate, log_path)
+    sender.start()
+    outbox = NotificationOutbox(db, sender)
+    scheduler = ReminderScheduler(db, lambda reminder: f"Подписка на канал {reminder.channel} истекла", outbox=outbox,
+                                  chunk_size=chunk_size)
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(scheduler.run()), asyncio.create_task(outbox.run())]
+    applied_at = None
+    while True:
+        await asyncio.sleep(0.05)
+        active = await db._run("benchmark", db._fetchone, "SELECT COUNT(*) FROM subscriptions WHERE is_active = 1", ())
+        if active[0]:
+            continue
+        if applied_at is None:
+            applied_at = time.perf_counter() - started
+        if not await db.get_pending_notifications(1):
+            break
+    delivered_at = time.perf_counter() - started
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await sender.stop()
+    await db.close()
+    return applied_at, delivered_at, scheduler.applied
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sweep.db")
+        await fill(path, args.users)
+        if not args.crash:
+            applied_at, delivered_at, applied = await sweep(path, args.chunk_size, args.send_rate)
+            print(f"chunk {args.chunk_size}: {applied} окончаний записано за {applied_at:.2f} с "
+                  f"({applied / applied_at:.0f}/с), уведомления доставлены за {delivered_at:.2f} с")
+            return
+
+        log_path = os.path.join(tmp, "delivered.log")
+        command = [sys.executable, "-m", "benchmarks.expiry_sweep", "--child", path, log_path,
+                   "--chunk-size", str(args.chunk_size), "--send-rate", str(args.send_rate)]
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        rng = random.Random(args.seed)
+        for _ in range(args.crash):
+            process = subprocess.Popen(command, cwd=cwd)
+            time.sleep(rng.uniform(0.5, 2.0))
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+        subprocess.run(command, cwd=cwd, check=True)
+
+        with open(log_path) as f:
+            counts = Counter(int(line) for line in f)
+        lost = args.users - len(counts)
+        duplicated = sum(1 for count in counts.values() if count > 1)
+        print(f"{args.crash} падений: доставлено {sum(counts.values())} уведомлений {len(counts)} пользователям, "
+              f"потеряно {lost}, с повтором {duplicated}")
+
+
+def child(args):
+    # Процесс, который убивает --crash: пишет доставленные сообщения в журнал
+    path, log_path = args.child
+    asyncio.run(sweep(path, args.chunk_size, args.send_rate, log_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--send-rate", type=float, default=0, help="сообщений в секунду, 0 — без ограничения")
+    parser.add_argument("--crash", type=int, default=0, help="сколько раз убить процесс посреди работы")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+    else:
+        asyncio.run(run(args))
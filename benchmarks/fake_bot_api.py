@@ -0,0 +1,147 @@
+# Локальная замена Telegram Bot API для нагрузочных тестов.
+# Эмулирует лимиты Telegram: при превышении скорости отвечает 429 с retry_after.
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+TOKEN = "123456:fake-token-for-benchmarks"
+
+
+class FakeBotAPI:
+    def __init__(self, global_rate: int = 30, per_chat_rate: int = 1, latency: float = 0.005,
+                 retry_after: int = 1, limited_methods=("sendmessage", "sendinvoice")):
+        self.global_rate = global_rate
+        # Методы, к которым применяются лимиты (в нижнем регистре)
+        self.limited_methods = limited_methods
+        self.per_chat_rate = per_chat_rate
+        self.latency = latency
+        self.retry_after = retry_after
+        self.calls = defaultdict(int)
+        self.rejected = 0
+        self.messages = []
+        self._global_window = deque()
+        self._chat_windows = defaultdict(deque)
+        self._message_id = 0
+        self._runner = None
+        self.url = None
+        # Апдейты для getUpdates и время ответов бота по чатам
+        self.updates = []
+        self._updates_event = asyncio.Event()
+        self.replies = defaultdict(list)
+        # Удалённые из каналов пользователи: (chat_id, user_id)
+        self.banned = []
+        self._invite_id = 0
+        # Вызывается с (метод в нижнем регистре, параметры) для каждого принятого запроса бота
+        self.on_call = None
+
+    def push_update(self, update: dict):
+        self.updates.append(update)
+        self._updates_event.set()
+
+    async def get_updates(self, data: dict):
+        offset = int(data.get("offset", 0) or 0)
+        limit = int(data.get("limit", 100) or 100)
+        timeout = float(data.get("timeout", 0) or 0)
+        # Подтверждённые (id < offset) апдейты больше не отдаём
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    @staticmethod
+    def _over_limit(window: deque, limit: int, now: float) -> bool:
+        # Скользящее окно в одну секунду
+        while window and now - window[0] >= 1:
+            window.popleft()
+        if len(window) >= limit:
+            return True
+        window.append(now)
+        return False
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+
+        if method.lower() == "getupdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(data)})
+        if method.lower() == "getme":
+            return web.json_response({"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+            }})
+
+        if method.lower() in self.limited_methods:
+            now = time.monotonic()
+            chat_id = int(data["chat_id"])
+            if self._over_limit(self._global_window, self.global_rate, now) or \
+                    self._over_limit(self._chat_windows[chat_id], self.per_chat_rate, now):
+                self.rejected += 1
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                })
+
+        if self.on_call is not None:
+            self.on_call(method.lower(), data)
+
+        if method.lower() == "banchatmember":
+            self.banned.append((int(data["chat_id"]), int(data["user_id"])))
+            return web.json_response({"ok": True, "result": True})
+        if method.lower() == "createchatinvitelink":
+            self._invite_id += 1
+            return web.json_response({"ok": True, "result": {
+                "invite_link": f"https://t.me/+fake{self._invite_id}",
+                "creator": {"id": 123456, "is_bot": True, "first_name": "Fake"},
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "name": data.get("name"),
+                "expire_date": int(data["expire_date"]) if data.get("expire_date") else None,
+                "member_limit": int(data["member_limit"]) if data.get("member_limit") else None,
+            }})
+
+        if method.lower() in ("sendmessage", "sendinvoice"):
+            chat_id = int(data["chat_id"])
+            self._message_id += 1
+            self.messages.append((chat_id, data.get("text")))
+            self.replies[chat_id].append(time.perf_counter())
+            return web.json_response({"ok": True, "result": {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }})
+
+        return web.json_response({"ok": True, "result": True})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def make_bot(self) -> Bot:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.url))
+        return Bot(token=TOKEN, session=session)
@@ -0,0 +1,286 @@
+# Нагрузочный тест всего сценария бота без Telegram и ЮКассы.
+#
+# Диспетчер из main.py работает через long polling с локальным фейковым Bot API.
+# Синтетические пользователи проходят /start -> имя -> контакт -> выбор канала
+# (sendInvoice) -> pre_checkout_query -> successful_payment; часть из них вместо
+# оплаты в Telegram платит через ЮКассу: фейковая ЮКасса шлёт подписанный
+# webhook на webhook-сервер бота. Каждый следующий шаг пользователь делает,
+# только получив ответ бота на предыдущий, поэтому одновременно в сценарии
+# находится не больше --concurrency пользователей.
+#
+# Отчёт: p50/p99 по каждому шагу (от отправки апдейта до ответа бота) и по
+# сценарию целиком, пропускная способность. Выбор пользователей для ЮКассы
+# задаётся --seed, поэтому прогоны с одинаковыми параметрами сравнимы;
+# --json сохраняет результат для сравнения с предыдущими прогонами.
+#
+# Запуск: python -m benchmarks.load_test --users 2000 --concurrency 200
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks.fake_bot_api import TOKEN, FakeBotAPI  # noqa: E402
+
+config.BOT_TOKEN = TOKEN
+
+import main  # noqa: E402
+import webhook_server  # noqa: E402
+
+YOOKASSA_SECRET = "load-test-secret"
+WEBHOOK_PORT = 5105
+CHANNEL = 1
+
+# Шаг сценария -> метод Bot API, которым бот на него отвечает
+TELEGRAM_FLOW = (
+    ("start", "sendmessage"),
+    ("name", "sendmessage"),
+    ("contact", "sendmessage"),
+    ("invoice", "sendinvoice"),
+    ("pre_checkout", "answerprecheckoutquery"),
+    ("payment", "sendmessage"),
+)
+YOOKASSA_FLOW = TELEGRAM_FLOW[:4] + (("yookassa", "sendmessage"),)
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class SyntheticUser:
+    def __init__(self, user_id: int, flow):
+        self.user_id = user_id
+        self.flow = flow
+        self.step = 0
+        self.step_started = 0.0
+        self.flow_started = 0.0
+
+    @property
+    def expected_method(self):
+        return self.flow[self.step][1]
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, users: int, concurrency: int, yookassa_share: float, seed: int):
+        rng = random.Random(seed)
+        self.api = api
+        self.users = [
+            SyntheticUser(user_id, YOOKASSA_FLOW if rng.random() < yookassa_share else TELEGRAM_FLOW)
+            for user_id in range(1, users + 1)
+        ]
+        self.by_id = {user.user_id: user for user in self.users}
+        self.concurrency = concurrency
+        self.latencies = defaultdict(list)
+        self.flow_latencies = []
+        self.finished = 0
+        self.done = asyncio.Event()
+        self._next_user = 0
+        self._update_id = 0
+        self._tasks = set()
+        self._session = None
+
+    # --- Апдейты от имени пользователя ---
+
+    def _push(self, user: SyntheticUser, **fields):
+        self._update_id += 1
+        self.api.push_update({"update_id": self._update_id, **fields})
+
+    def _message(self, user: SyntheticUser, **fields):
+        self._push(user, message={
+            "message_id": self._update_id + 1,
+            "date": int(time.time()),
+            "chat": {"id": user.user_id, "type": "private"},
+            "from": {"id": user.user_id, "is_bot": False, "first_name": f"User{user.user_id}"},
+            **fields,
+        })
+
+    def _sender(self, user: SyntheticUser):
+        return {"id": user.user_id, "is_bot": False, "first_name": f"User{user.user_id}"}
+
+    def _send_step(self, user: SyntheticUser):
+        step = user.flow[user.step][0]
+        user.step_started = time.perf_counter()
+        payload = f"subscription_channel_{CHANNEL}"
+        if step == "start":
+            user.flow_started = user.step_started
+            self._message(user, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+        elif step == "name":
+            self._message(user, text=f"User {user.user_id}")
+        elif step == "contact":
+            self._message(user, contact={
+                "phone_number": f"+7999{user.user_id:07d}", "first_name": f"User{user.user_id}", "user_id": user.user_id,
+            })
+        elif step == "invoice":
+            self._push(user, callback_query={
+                "id": f"cb-{user.user_id}", "from": self._sender(user), "chat_instance": str(user.user_id),
+                "data": f"pay_channel_{CHANNEL}",
+            })
+        elif step == "pre_checkout":
+            self._push(user, pre_checkout_query={
+                "id": f"pcq-{user.user_id}", "from": self._sender(user), "currency": "RUB",
+                "total_amount": 30000, "invoice_payload": payload,
+            })
+        elif step == "payment":
+            self._message(user, successful_payment={
+                "currency": "RUB", "total_amount": 30000, "invoice_payload": payload,
+                "telegram_payment_charge_id": f"tg-{user.user_id}", "provider_payment_charge_id": f"pr-{user.user_id}",
+            })
+        elif step == "yookassa":
+            task = asyncio.create_task(self._post_yookassa(user, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _post_yookassa(self, user: SyntheticUser, payload: str):
+        # Фейковая ЮКасса: подписанное уведомление об успешном платеже
+        data = {
+            "event": "payment.succeeded",
+            "object": {
+                "id": f"yk-{user.user_id}",
+                "amount": {"value": "300.00", "currency": "RUB"},
+                "metadata": {"user_id": str(user.user_id), "payload": payload},
+            },
+        }
+        body = json.dumps(data).encode()
+        signature = hmac.new(YOOKASSA_SECRET.encode(), body, hashlib.sha256).hexdigest()
+        async with self._session.post(f"http://127.0.0.1:{WEBHOOK_PORT}/webhook", data=body, headers={
+            "Content-Type": "application/json", "Yookassa-Signature": signature,
+        }) as response:
+            await response.read()
+
+    # --- Ответы бота ---
+
+    def on_call(self, method: str, data: dict):
+        if method == "answerprecheckoutquery":
+            user_id = int(data["pre_checkout_query_id"].split("-")[1])
+        elif "chat_id" in data:
+            user_id = int(data["chat_id"])
+        else:
+            return
+        user = self.by_id.get(user_id)
+        if user is None or user.step >= len(user.flow) or method != user.expected_method:
+            return
+        now = time.perf_counter()
+        self.latencies[user.flow[user.step][0]].append(now - user.step_started)
+        user.step += 1
+        if user.step < len(user.flow):
+            self._send_step(user)
+            return
+        self.flow_latencies.append(now - user.flow_started)
+        self.finished += 1
+        if self.finished == len(self.users):
+            self.done.set()
+        else:
+            self._start_next()
+
+    def _start_next(self):
+        if self._next_user < len(self.users):
+            user = self.users[self._next_user]
+            self._next_user += 1
+            self._send_step(user)
+
+    async def run(self, timeout: float) -> float:
+        self.api.on_call = self.on_call
+        async with aiohttp.ClientSession() as session:
+            self._session = session
+            started = time.perf_counter()
+            for _ in range(min(self.concurrency, len(self.users))):
+                self._start_next()
+            try:
+                await asyncio.wait_for(self.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                print(f"Тайм-аут: сценарий завершили {self.finished} из {len(self.users)} пользователей")
+            elapsed = time.perf_counter() - started
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.api.on_call = None
+        await self._settle()
+        return elapsed
+
+    async def _settle(self, quiet: float = 0.3):
+        # Последние ответы бота (второе сообщение после оплаты, answerCallbackQuery)
+        # ещё в пути: ждём, пока к API перестанут приходить запросы кроме getUpdates
+        def busy():
+            return sum(count for method, count in self.api.calls.items() if method.lower() != "getupdates")
+
+        before = None
+        while before != busy():
+            before = busy()
+            await asyncio.sleep(quiet)
+
+    def report(self, elapsed: float) -> dict:
+        result = {"elapsed": elapsed, "flows": self.finished, "flows_per_s": self.finished / elapsed, "steps": {}}
+        print(f"Сценариев: {self.finished} за {elapsed:.2f} с ({result['flows_per_s']:.1f}/с), "
+              f"апдейтов: {self._update_id} ({self._update_id / elapsed:.0f}/с)")
+        rows = [(step, self.latencies[step]) for step, _ in TELEGRAM_FLOW + YOOKASSA_FLOW[-1:]]
+        rows.append(("flow", self.flow_latencies))
+        for step, values in rows:
+            if not values:
+                continue
+            stats = {
+                "count": len(values),
+                "p50_ms": percentile(values, 0.5) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": max(values) * 1000,
+            }
+            result["steps"][step] = stats
+            print(f"{step:>13}: {stats['count']:>6}  p50 {stats['p50_ms']:7.1f} мс  "
+                  f"p99 {stats['p99_ms']:7.1f} мс  max {stats['max_ms']:7.1f} мс")
+        return result
+
+
+async def run(args):
+    api = await FakeBotAPI(global_rate=10 ** 9, per_chat_rate=10 ** 9, latency=args.api_latency).start()
+    bot = api.make_bot()
+    webhook_server.YOOKASSA_SECRET_KEY = YOOKASSA_SECRET
+    config.WEBHOOK_HOST, config.WEBHOOK_PORT = "127.0.0.1", WEBHOOK_PORT
+    with tempfile.TemporaryDirectory() as tmp:
+        # Те же хуки, что и в main.main(), только без планировщика и сводки
+        application = main.create_application(bot=bot, db_path=os.path.join(tmp, "load.db"))
+        application.add_hook("db", application.db.open, application.db.close)
+        application.add_hook("bot", stop=bot.session.close)
+        application.add_hook("sender", application.sender.start, application.sender.stop, stage=1)
+        application.add_hook("storage", stop=application.dp.storage.close, stage=1)
+        application.add_webhook_server(stage=2)
+        await application.start()
+        dp = application.dp
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False,
+                                                       polling_timeout=1))
+        try:
+            test = LoadTest(api, args.users, args.concurrency, args.yookassa_share, args.seed)
+            elapsed = await test.run(args.timeout)
+        finally:
+            await dp.stop_polling()
+            await polling
+            await application.stop()
+            await api.stop()
+
+    result = test.report(elapsed)
+    if args.json:
+        result["args"] = vars(args)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="пользователей в сценарии одновременно")
+    parser.add_argument("--yookassa-share", type=float, default=0.2, help="доля оплат через ЮКассу")
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="куда сохранить результат")
+    logging.disable(logging.INFO)
+    asyncio.run(run(parser.parse_args()))
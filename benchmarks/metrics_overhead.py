@@ -0,0 +1,84 @@
+# Накладные расходы метрик: обработка апдейтов диспетчером с middleware метрик
+# и без него, стоимость одного observe() и рендеринга /metrics.
+#
+# Запуск: python -m benchmarks.metrics_overhead --updates 20000
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def make_update(i: int) -> Update:
+    return Update.model_validate({
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "date": 0,
+            "chat": {"id": 1 + i % 100, "type": "private"},
+            "from": {"id": 1 + i % 100, "is_bot": False, "first_name": "User"},
+            "text": "привет",
+        },
+    })
+
+
+async def feed(dp: Dispatcher, bot: Bot, updates) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return time.perf_counter() - started
+
+
+def make_dispatcher(with_metrics: bool) -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: Message):
+        return None
+
+    if with_metrics:
+        metrics.setup_dispatcher(dp)
+    return dp
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    bot = Bot(token="123456:fake-token-for-benchmarks")
+    updates = [make_update(i) for i in range(args.updates)]
+    try:
+        # Прогрев, затем по два прогона в чередующемся порядке
+        await feed(make_dispatcher(False), bot, updates[:1000])
+        plain = metered = 0.0
+        for _ in range(2):
+            plain += await feed(make_dispatcher(False), bot, updates)
+            metered += await feed(make_dispatcher(True), bot, updates)
+    finally:
+        await bot.session.close()
+
+    count = 2 * args.updates
+    print(f"без метрик: {plain / count * 1e6:.1f} мкс/апдейт, с метриками: {metered / count * 1e6:.1f} мкс/апдейт, "
+          f"накладные расходы: {(metered - plain) / count * 1e6:.1f} мкс ({(metered / plain - 1) * 100:.1f}%)")
+
+    histogram = metrics.Histogram("bench_seconds", "", ("label",), registry=metrics.Registry())
+    started = time.perf_counter()
+    for i in range(100000):
+        histogram.observe(0.003, "a")
+    print(f"Histogram.observe: {(time.perf_counter() - started) / 100000 * 1e9:.0f} нс")
+
+    started = time.perf_counter()
+    text = metrics.REGISTRY.render()
+    print(f"рендеринг /metrics: {(time.perf_counter() - started) * 1000:.2f} мс, {len(text)} байт")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
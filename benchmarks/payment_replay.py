@@ -0,0 +1,69 @@
+# Повторная доставка одного и того же webhook ЮКассы: подписка должна
+# продлиться ровно один раз, а повторы — отсекаться кэшем недавних уведомлений,
+# не доходя до базы (после окна кэша — уникальным ключом платежа).
+#
+# Запуск: python -m benchmarks.payment_replay --replays 10000
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_server  # noqa: E402
+from benchmarks.webhook_load import SECRET, make_payload, sign  # noqa: E402
+from database import Database, format_ts  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replays", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    webhook_server.YOOKASSA_SECRET_KEY = SECRET
+    webhook_server.logger.disabled = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        await db.open()
+        await db.upsert_user(1000, "user", "User")
+
+        body, _ = make_payload(0)
+        body = body.replace('"metadata": {"user_id": "1000"}',
+                            '"metadata": {"user_id": "1000", "payload": "subscription_channel_1"}')
+        signature = sign(body.encode())
+        runner = await webhook_server.start_webhook_server(webhook_server.create_app(db=db), "127.0.0.1", 5103)
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(session):
+            async with semaphore:
+                async with session.post("http://127.0.0.1:5103/webhook", data=body, headers={
+                    "Content-Type": "application/json", "Yookassa-Signature": signature,
+                }) as response:
+                    await response.read()
+                    return response.status
+
+        try:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+                started = time.perf_counter()
+                statuses = await asyncio.gather(*(one(session) for _ in range(args.replays)))
+                elapsed = time.perf_counter() - started
+        finally:
+            await runner.cleanup()
+
+        payments = await db._run("benchmark", db._fetchone, "SELECT COUNT(*) FROM payments", ())
+        subscriptions = await db.get_user_subscriptions(1000)
+        await db.close()
+
+    print(f"{args.replays} повторов за {elapsed:.2f} с ({args.replays / elapsed:.0f} запросов/с), "
+          f"не 200: {sum(status != 200 for status in statuses)}")
+    print(f"записей в payments: {payments[0]}, подписка до: {format_ts(subscriptions[0][3])}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
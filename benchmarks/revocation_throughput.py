@@ -0,0 +1,67 @@
+# Удаление пользователей из канала через MemberRevoker на фейковом Bot API.
+# API ограничивает скорость banChatMember и отвечает 429, как Telegram.
+#
+# Запуск: python -m benchmarks.revocation_throughput --users 500
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from database import Database  # noqa: E402
+from revocation import MemberRevoker  # noqa: E402
+
+CHAT_ID = -1001234567890
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--api-rate", type=int, default=30)
+    args = parser.parse_args()
+
+    api = await FakeBotAPI(global_rate=args.api_rate, per_chat_rate=args.api_rate,
+                           limited_methods=("banchatmember",)).start()
+    bot = api.make_bot()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"))
+            await db.open()
+            await db._run("benchmark", db._write, "UPDATE channels SET chat_id = ? WHERE id = 1", (CHAT_ID,))
+            db.invalidate_channels()
+            # Канал 2 без chat_id: такие задачи должны уйти администратору
+            end_ts = int(time.time()) - 60
+            await db._run("benchmark", db._write_many,
+                          "INSERT INTO revocations (user_id, channel_id, end_ts, updated_at) VALUES (?, ?, ?, ?)",
+                          [(user_id, 1 if user_id % 10 else 2, end_ts, end_ts) for user_id in range(1, args.users + 1)])
+
+            statuses = Counter()
+
+            async def on_result(user_id, channel_id, status, error):
+                statuses[status] += 1
+
+            revoker = MemberRevoker(bot, db, concurrency=args.concurrency, on_result=on_result)
+            started = time.perf_counter()
+            while await revoker.run_batch():
+                pass
+            elapsed = time.perf_counter() - started
+            left = await db.get_pending_revocations(args.users)
+            await db.close()
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+    kicked = len(set(api.banned))
+    print(f"MemberRevoker: {args.users} задач за {elapsed:.2f} с ({args.users / elapsed:.0f}/с), "
+          f"статусы: {dict(statuses)}, удалено в API: {kicked}, повторов после 429: {revoker.retried_429}, "
+          f"осталось в очереди: {len(left)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+# Пропускная способность и обработка 429 у OutboundSender на фейковом Bot API.
+#
+# Запуск: python -m benchmarks.sender_throughput --messages 600 --chats 300
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_bot_api import FakeBotAPI  # noqa: E402
+from database import Database  # noqa: E402
+from sender import OutboundSender  # noqa: E402
+
+
+async def naive_loop(bot, messages):
+    # Как было раньше: последовательная отправка, ошибки просто теряются
+    lost = 0
+    for chat_id, text in messages:
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception:
+            lost += 1
+    return lost
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=600)
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=25)
+    parser.add_argument("--api-rate", type=int, default=30)
+    args = parser.parse_args()
+
+    # Часть сообщений уходит одним и тем же чатам (как уведомления администраторам)
+    messages = [(1 + i % args.chats, f"Сообщение {i}") for i in range(args.messages)]
+
+    api = await FakeBotAPI(global_rate=args.api_rate).start()
+    bot = api.make_bot()
+    try:
+        started = time.perf_counter()
+        lost = await naive_loop(bot, messages)
+        elapsed = time.perf_counter() - started
+        print(f"цикл send_message: {args.messages - lost} доставлено, {lost} потеряно, "
+              f"{elapsed:.2f} с, 429 от API: {api.rejected}")
+
+        api.rejected = 0
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"))
+            await db.open()
+            sender = OutboundSender(bot, db, global_rate=args.rate)
+            sender.start()
+            started = time.perf_counter()
+            results = await asyncio.gather(*(sender.send_message(chat_id, text) for chat_id, text in messages))
+            elapsed = time.perf_counter() - started
+            await sender.stop()
+            await db.close()
+        delivered = sum(result is not None for result in results)
+        print(f"OutboundSender: {delivered} доставлено, {sender.dead} в dead_letters, {elapsed:.2f} с "
+              f"({delivered / elapsed:.1f} сообщений/с), 429 от API: {api.rejected}, повторов: {sender.retried_429}")
+    finally:
+        await bot.session.close()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+# Холодный старт бота: от запуска процесса до ответа на первый апдейт.
+#
+# Каждый прогон запускает новый процесс python, который собирает приложение
+# через main.create_application (бот ходит в локальный фейковый Bot API,
+# база — новая во временном каталоге) и вызывает main.main(). Апдейт /start
+# уже лежит в очереди фейкового API, поэтому время до первого sendMessage —
+# это импорт, инициализация, открытие базы, запуск webhook-сервера и первый
+# getUpdates. Разбивку по компонентам показывает python main.py --profile-startup.
+#
+# Запуск: python -m benchmarks.startup_time --runs 10
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_bot_api import TOKEN, FakeBotAPI  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import asyncio, os, sys
+sys.path.insert(0, os.environ["BOT_ROOT"])
+import config
+config.BOT_TOKEN = os.environ["BOT_TOKEN"]
+config.WEBHOOK_HOST, config.WEBHOOK_PORT = "127.0.0.1", 0
+import main
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+bot = Bot(token=config.BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(os.environ["FAKE_API_URL"])))
+asyncio.run(main.main(main.create_application(bot=bot, db_path=os.environ["BOT_DB"])))
+"""
+
+
+async def cold_start(api: FakeBotAPI, update_id: int, tmp: str, timeout: float) -> float:
+    answered = asyncio.get_running_loop().create_future()
+
+    def on_call(method: str, data: dict):
+        if method == "sendmessage" and not answered.done():
+            answered.set_result(time.perf_counter())
+
+    api.on_call = on_call
+    api.updates.clear()
+    api.push_update({"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()),
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "User"},
+        "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    }})
+    env = dict(os.environ, BOT_ROOT=ROOT, BOT_TOKEN=TOKEN, FAKE_API_URL=api.url,
+               BOT_DB=os.path.join(tmp, f"startup_{update_id}.db"))
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", CHILD, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        return await asyncio.wait_for(answered, timeout) - started
+    finally:
+        process.terminate()
+        await process.wait()
+        api.on_call = None
+
+
+async def run(args):
+    api = await FakeBotAPI(global_rate=10 ** 9, per_chat_rate=10 ** 9, latency=args.api_latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = [await cold_start(api, run_id, tmp, args.timeout) for run_id in range(1, args.runs + 1)]
+    finally:
+        await api.stop()
+    results.sort()
+    print(f"Холодный старт до первого ответа ({args.runs} прогонов): "
+          f"медиана {statistics.median(results) * 1000:.0f} мс, "
+          f"мин {results[0] * 1000:.0f} мс, макс {results[-1] * 1000:.0f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--timeout", type=float, default=60)
+    asyncio.run(run(parser.parse_args()))
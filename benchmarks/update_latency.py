@@ -0,0 +1,167 @@
+# Задержка обработки апдейтов в режимах long polling и webhook.
+# Апдейты берутся из JSONL-файла (по одному объекту Update в строке, например
+# сохранённые из getUpdates), а без файла генерируется регистрация N пользователей:
+# /start -> имя -> контакт.
+#
+# Запуск: python -m benchmarks.update_latency --users 500
+#         python -m benchmarks.update_latency --updates captured_updates.jsonl
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from benchmarks.fake_bot_api import TOKEN, FakeBotAPI  # noqa: E402
+
+config.BOT_TOKEN = TOKEN
+
+import main  # noqa: E402
+from webhook_server import add_telegram_route, create_app, start_webhook_server  # noqa: E402
+
+
+def synthetic_rounds(users: int):
+    # Шаги одного пользователя идут в разных раундах, чтобы сохранялся их порядок
+    def message(update_id, user_id, **fields):
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            **fields,
+        }}
+
+    start, names, contacts = [], [], []
+    for user_id in range(1, users + 1):
+        start.append(message(user_id, user_id, text="/start", entities=[{"type": "bot_command", "offset": 0, "length": 6}]))
+        names.append(message(users + user_id, user_id, text=f"User {user_id}"))
+        contacts.append(message(2 * users + user_id, user_id, contact={
+            "phone_number": "+79991234567", "first_name": f"User{user_id}", "user_id": user_id,
+        }))
+    return [start, names, contacts]
+
+
+def load_rounds(path: str):
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    # Апдейты нумеруются заново, чтобы их можно было проигрывать повторно
+    for update_id, update in enumerate(updates, start=1):
+        update["update_id"] = update_id
+    return [updates]
+
+
+class Timings:
+    def __init__(self):
+        self.arrived = {}
+        self.done = {}
+        self.event = asyncio.Event()
+        self.expected = 0
+
+    async def middleware(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.done[event.update_id] = time.perf_counter()
+            if len(self.done) >= self.expected:
+                self.event.set()
+
+    async def wait(self, expected: int):
+        self.expected = expected
+        if len(self.done) < expected:
+            self.event.clear()
+            await asyncio.wait_for(self.event.wait(), 120)
+
+    def report(self, mode: str, elapsed: float):
+        latencies = sorted((self.done[i] - self.arrived[i]) * 1000 for i in self.done if i in self.arrived)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{mode:>8}: {len(latencies)} апдейтов за {elapsed:.2f} с ({len(latencies) / elapsed:.0f}/с), "
+              f"p50 {p50:.1f} мс, p99 {p99:.1f} мс, max {latencies[-1]:.1f} мс")
+
+
+async def run_polling(api: FakeBotAPI, application, rounds, timings: Timings):
+    dp = application.dp
+    polling = asyncio.create_task(dp.start_polling(application.bot, handle_signals=False, close_bot_session=False,
+                                                   polling_timeout=1))
+    started, total = time.perf_counter(), 0
+    for updates in rounds:
+        for update in updates:
+            timings.arrived[update["update_id"]] = time.perf_counter()
+            api.push_update(update)
+        total += len(updates)
+        await timings.wait(total)
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    return elapsed
+
+
+async def run_webhook(application, rounds, timings: Timings, concurrency: int):
+    processor = application.update_processor
+    app = create_app(application.bot, application.db)
+    add_telegram_route(app, processor, "/telegram")
+    runner = await start_webhook_server(app, "127.0.0.1", 5104)
+    processor.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(session, update):
+        async with semaphore:
+            timings.arrived[update["update_id"]] = time.perf_counter()
+            async with session.post("http://127.0.0.1:5104/telegram", json=update) as response:
+                await response.read()
+
+    started, total = time.perf_counter(), 0
+    async with aiohttp.ClientSession() as session:
+        for updates in rounds:
+            await asyncio.gather(*(post(session, update) for update in updates))
+            total += len(updates)
+            await timings.wait(total)
+    elapsed = time.perf_counter() - started
+    await processor.drain()
+    await runner.cleanup()
+    return elapsed
+
+
+async def run_mode(mode: str, rounds, args):
+    api = await FakeBotAPI(global_rate=10 ** 9, per_chat_rate=10 ** 9, latency=args.api_latency).start()
+    bot = api.make_bot()
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as tmp:
+        application = main.create_application(bot=bot, db_path=os.path.join(tmp, "bench.db"))
+        application.add_hook("db", application.db.open, application.db.close)
+        application.add_hook("bot", stop=bot.session.close)
+        application.add_hook("sender", application.sender.start, application.sender.stop, stage=1)
+        application.add_hook("storage", stop=application.dp.storage.close, stage=1)
+        application.dp.update.outer_middleware(timings.middleware)
+        await application.start()
+        try:
+            if mode == "polling":
+                elapsed = await run_polling(api, application, rounds, timings)
+            else:
+                elapsed = await run_webhook(application, rounds, timings, args.concurrency)
+        finally:
+            await application.stop()
+            await api.stop()
+    timings.report(mode, elapsed)
+
+
+async def run(args):
+    rounds = load_rounds(args.updates) if args.updates else synthetic_rounds(args.users)
+    for mode in args.modes:
+        await run_mode(mode, rounds, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", help="JSONL-файл с сохранёнными апдейтами")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--modes", nargs="+", default=["polling", "webhook"], choices=["polling", "webhook"])
+    main.logging.getLogger("aiogram").setLevel("WARNING")
+    asyncio.run(run(parser.parse_args()))
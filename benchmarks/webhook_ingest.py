@@ -0,0 +1,126 @@
+# Приём уведомлений ЮКассы: сколько стоит ответ на корректное, повторное,
+# неподписанное, испорченное и слишком большое уведомление.
+#
+# Время обработчика меряется на сервере (middleware вокруг маршрута), без
+# сети и клиента; запросы/с — с клиентом aiohttp на той же машине; в него
+# входит запись уведомления в webhook_inbox. На 503 (база недоступна) клиент,
+# как и ЮКасса, повторяет запрос позже. Платежи пишутся в базу во временном
+# каталоге; в конце проверяется, что каждый корректный платёж записан ровно
+# один раз.
+#
+# Запуск: python -m benchmarks.webhook_ingest --requests 5000 --concurrency 50
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_server  # noqa: E402
+from benchmarks.webhook_load import SECRET, make_payload, sign  # noqa: E402
+from database import Database  # noqa: E402
+
+PORT = 5104
+
+
+def scenarios(requests: int):
+    valid = []
+    for i in range(requests):
+        body, signature = make_payload(i)
+        body = body.replace('"metadata": {"user_id": "%d"}' % (1000 + i),
+                            '"metadata": {"user_id": "%d", "payload": "subscription_channel_1"}' % (1000 + i))
+        valid.append((body.encode(), sign(body.encode())))
+    oversized = b'{"event": "payment.succeeded", "object": {"id": "x", "pad": "' + b"x" * (1024 * 1024) + b'"}}'
+    return [
+        ("корректные", valid),
+        ("повторы", valid),
+        ("неверная подпись", [(body, "0" * 64) for body, _ in valid]),
+        ("испорченные", [(body[:-10], sign(body[:-10])) for body, _ in valid]),
+        ("больше лимита", [(oversized, sign(oversized))] * max(1, requests // 10)),
+    ]
+
+
+async def load(payloads, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = Counter()
+
+    async def one(session, body, signature):
+        async with semaphore:
+            while True:
+                async with session.post(f"http://127.0.0.1:{PORT}/webhook", data=body, headers={
+                    "Content-Type": "application/json", "Yookassa-Signature": signature,
+                }) as response:
+                    await response.read()
+                if response.status != 503:
+                    return response.status
+                statuses[503] += 1
+                await asyncio.sleep(0.05)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        started = time.perf_counter()
+        statuses.update(await asyncio.gather(*(one(session, body, signature) for body, signature in payloads)))
+        elapsed = time.perf_counter() - started
+    return len(payloads) / elapsed, statuses
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    webhook_server.YOOKASSA_SECRET_KEY = SECRET
+    webhook_server.logger.disabled = True
+    handler_times = []
+
+    @web.middleware
+    async def timing(request, handler):
+        started = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            handler_times.append(time.perf_counter() - started)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        await db.open()
+        await db._run("benchmark", db._write_many, "INSERT INTO users (id, full_name) VALUES (?, ?)",
+                      [(1000 + i, f"User {i}") for i in range(args.requests)])
+
+        app = webhook_server.create_app(db=db)
+        app.middlewares.append(timing)
+        runner = await webhook_server.start_webhook_server(app, "127.0.0.1", PORT)
+        try:
+            for name, payloads in scenarios(args.requests):
+                handler_times.clear()
+                rps, statuses = await load(payloads, args.concurrency)
+                times = sorted(handler_times)
+                codes = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items()))
+                print(f"{name:>16}: {rps:6.0f} запросов/с, обработчик p50 {statistics.median(times) * 1e6:.0f} мкс, "
+                      f"p99 {times[int(len(times) * 0.99)] * 1e6:.0f} мкс ({codes})")
+                if name == "корректные":
+                    started = time.perf_counter()
+                    while await db.get_due_webhook_events(1):
+                        await asyncio.sleep(0.01)
+                    print(f"{'':>16}  фоновая обработка закончена через {time.perf_counter() - started:.2f} с "
+                          f"после последнего ответа")
+        finally:
+            await runner.cleanup()
+
+        payments = await db._run("benchmark", db._fetchone,
+                                 "SELECT COUNT(*), COUNT(DISTINCT payment_id) FROM payments", ())
+        subscriptions = await db._run("benchmark", db._fetchone, "SELECT COUNT(*) FROM subscriptions", ())
+        await db.close()
+
+    print(f"платежей: {payments[0]} (уникальных {payments[1]}), подписок: {subscriptions[0]}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+# Нагрузочный тест webhook ЮКассы: запросы/с у aiohttp-сервера в event loop бота
+# и, если установлен Flask, у прежнего варианта (Flask dev server в потоке).
+#
+# Запуск: python -m benchmarks.webhook_load --requests 5000 --concurrency 50
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook_server  # noqa: E402
+
+SECRET = "benchmark-secret"
+
+
+def make_payload(i: int):
+    data = {
+        "event": "payment.succeeded",
+        "object": {
+            "id": f"payment-{i}",
+            "amount": {"value": "300.00", "currency": "RUB"},
+            "metadata": {"user_id": str(1000 + i)},
+        },
+    }
+    body = json.dumps(data)
+    return body, sign(body.encode())
+
+
+def sign(body: bytes) -> str:
+    # Подпись, которую проверяет webhook_server: HMAC-SHA256 от тела запроса
+    return hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def start_flask_server(port: int):
+    # Прежний обработчик: Flask + request.json, как в исходном webhook_server.py
+    from flask import Flask, jsonify, request
+    from werkzeug.serving import make_server
+
+    app = Flask("flask_baseline")
+
+    @app.route("/webhook", methods=["POST"])
+    def webhook():
+        signature = request.headers.get("Yookassa-Signature")
+        if not hmac.compare_digest(sign(request.get_data()), signature):
+            return jsonify({"error": "Invalid signature"}), 400
+        request.json
+        return jsonify({"status": "ok"}), 200
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+async def load(url: str, requests: int, concurrency: int):
+    payloads = [make_payload(i) for i in range(requests)]
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def one(session, body, signature):
+        nonlocal errors
+        async with semaphore:
+            async with session.post(url, data=body, headers={
+                "Content-Type": "application/json", "Yookassa-Signature": signature,
+            }) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session, body, signature) for body, signature in payloads))
+        elapsed = time.perf_counter() - started
+    return requests / elapsed, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    webhook_server.YOOKASSA_SECRET_KEY = SECRET
+    webhook_server.logger.disabled = True
+
+    try:
+        server = start_flask_server(5101)
+    except ImportError:
+        print("Flask не установлен, сравнение с прежним сервером пропущено")
+    else:
+        rps, errors = await load("http://127.0.0.1:5101/webhook", args.requests, args.concurrency)
+        server.shutdown()
+        print(f"Flask (dev server в потоке): {rps:.0f} запросов/с, ошибок: {errors}")
+
+    runner = await webhook_server.start_webhook_server(webhook_server.create_app(), "127.0.0.1", 5102)
+    try:
+        rps, errors = await load("http://127.0.0.1:5102/webhook", args.requests, args.concurrency)
+    finally:
+        await runner.cleanup()
+    print(f"aiohttp (в event loop бота): {rps:.0f} запросов/с, ошибок: {errors}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
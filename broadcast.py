@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcast:
+    """Рассылка сообщения сегменту пользователей.
+
+    Получатели читаются из базы страницами по id, поэтому в памяти только
+    текущая страница, а не весь сегмент. Сообщения идут через общую очередь
+    OutboundSender с её ограничением скорости, но рассылка держит в очереди
+    не больше window сообщений: ответы пользователям и уведомления не ждут,
+    пока уйдёт вся рассылка.
+    """
+
+    def __init__(self, db, sender, text: str, segment: str, channel: int = None, window: int = 50,
+                 page_size: int = 1000):
+        self.db = db
+        self.sender = sender
+        self.text = text
+        self.segment = segment
+        self.channel = channel
+        self.window = window
+        self.page_size = page_size
+        self.total = None
+        self.sent = 0
+        self.failed = 0
+
+    def _count(self, futures):
+        for future in futures:
+            # None — сообщение не доставлено и сохранено в dead_letters (например, бот заблокирован)
+            if future.result() is None:
+                self.failed += 1
+            else:
+                self.sent += 1
+
+    async def run(self):
+        self.total = await self.db.count_segment(self.segment, self.channel)
+        pending = set()
+        try:
+            async for user_ids in self.db.iter_segment(self.segment, self.channel, self.page_size):
+                for user_id in user_ids:
+                    if len(pending) >= self.window:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        self._count(done)
+                    pending.add(self.sender.send_message(user_id, self.text))
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                self._count(done)
+        finally:
+            # При отмене уже поставленные в очередь сообщения всё равно уйдут
+            if pending:
+                logger.warning(f"Рассылка прервана, в очереди отправки осталось {len(pending)} сообщений")
+        logger.info(f"Рассылка сегменту {self.segment}: отправлено {self.sent}, не доставлено {self.failed}")
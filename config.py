@@ -5,4 +5,58 @@ PAYMENT_PROVIDER_TOKEN = ''
 SHOP_ID = ""  # Полученный ShopID
 SHOP_API_KEY = ""  # Полученный секретный ключ 
 
-ADMIN_IDS = []   #Telegram User ID через запятую
\ No newline at end of file
+ADMIN_IDS = []   #Telegram User ID через запятую
+
+# Ограничения исходящих сообщений (лимиты Telegram: ~30 сообщений/с всего и 1/с в один чат)
+SEND_RATE_GLOBAL = 25
+SEND_RATE_PER_CHAT = 1
+SEND_WORKERS = 8
+BROADCAST_WINDOW = 50  # Сколько сообщений рассылки /broadcast может одновременно стоять в очереди отправки
+
+# Хранилище состояний FSM: "sqlite" (в users.db), "redis" (нужен пакет redis) или "memory"
+FSM_STORAGE = "sqlite"
+REDIS_URL = "redis://localhost:6379/0"
+FSM_STATE_TTL = 24 * 60 * 60  # Брошенные регистрации удаляются через сутки
+
+# Webhook-сервер ЮКассы. Если сертификат не указан, сервер работает по HTTP (например, за nginx)
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 5000
+WEBHOOK_SSL_CERT = ""  # Путь к сертификату
+WEBHOOK_SSL_KEY = ""  # Путь к закрытому ключу
+
+# Уведомления ЮКассы: подпись проверяется по телу запроса, до ответа уведомление записывается
+# в базу (webhook_inbox), а платёж обрабатывается в фоне с повторами
+YOOKASSA_MAX_BODY = 64 * 1024  # Запросы больше отклоняются (413), не дочитывая тело
+YOOKASSA_REPLAY_WINDOW = 24 * 60 * 60  # Сколько секунд помнить принятые уведомления, чтобы отсекать повторы
+YOOKASSA_REPLAY_CACHE_SIZE = 50000
+YOOKASSA_WORKERS = 4  # Сколько платежей обрабатывается одновременно
+YOOKASSA_MAX_ATTEMPTS = 10  # После стольких ошибок уведомление остаётся в webhook_inbox со статусом failed
+
+# Приём апдейтов Telegram: если указан TELEGRAM_WEBHOOK_URL (публичный https-адрес этого сервера),
+# бот работает через webhook на WEBHOOK_PORT, иначе через long polling
+TELEGRAM_WEBHOOK_URL = ""
+TELEGRAM_WEBHOOK_PATH = "/telegram"
+TELEGRAM_WEBHOOK_SECRET = ""  # Секрет для заголовка X-Telegram-Bot-Api-Secret-Token
+UPDATE_WORKERS = 32  # Сколько апдейтов обрабатывается одновременно
+
+# Удаление из каналов после окончания подписки (бот должен быть администратором канала с правом банить)
+REVOKE_CONCURRENCY = 5  # Сколько пользователей удаляется одновременно
+INVITE_LINK_TTL_HOURS = 24  # Срок действия одноразовой ссылки-приглашения
+
+# Окончания подписок и напоминания обрабатываются пачками: одна транзакция на пачку
+EXPIRY_CHUNK_SIZE = 500
+
+# Кэш пользователей в памяти: сколько записей держать и сколько секунд они действительны
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300
+
+# Число процессов-воркеров. При значении больше 1 главный процесс только принимает апдейты
+# и раздаёт их воркерам по id пользователя; планировщик работает в одном воркере (лидере)
+WORKER_PROCESSES = 1
+LEADER_LOCK_TTL = 30  # Через сколько секунд лидерство переходит к другому процессу, если лидер завис
+
+# Сводка для администраторов: отправляется раз в ADMIN_DIGEST_INTERVAL секунд
+# или сразу после ADMIN_DIGEST_MAX_EVENTS событий
+ADMIN_DIGEST_INTERVAL = 600
+ADMIN_DIGEST_MAX_EVENTS = 100
+ADMIN_ALERT_AMOUNT = 0  # Об оплатах от этой суммы (руб.) сообщать сразу; 0 — только в сводке
\ No newline at end of file
@@ -0,0 +1,1049 @@
+import asyncio
+import csv
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import logging
+
+from metrics import DB_QUERY_SECONDS
+from user_cache import UserCache
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+USER_COLUMNS = "id, username, full_name, phone"
+
+CHANNEL_COLUMNS = "id, title, price, duration_days, invite_link, chat_id"
+
+# Колонки выгрузки /get_users_db; импорт принимает файл в том же формате
+EXPORT_COLUMNS = ["id", "username", "full_name", "phone", "channel_id", "is_paid", "payment_date", "subscription_end_date"]
+
+# Сегменты для рассылки: условие на строку users u; у "channel" один параметр — id канала
+SEGMENTS = {
+    "all": "1",
+    "active": "EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = u.id AND s.is_active = 1)",
+    "inactive": "NOT EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = u.id AND s.is_active = 1)",
+    "channel": "EXISTS (SELECT 1 FROM subscriptions s WHERE s.user_id = u.id AND s.channel_id = ? AND s.is_active = 1)",
+}
+
+# Счётчик в generations, который увеличивают массовые изменения подписок
+SUBSCRIPTIONS_GENERATION = "subscriptions"
+
+# Исходная схема; всё остальное создают и меняют миграции ниже
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    full_name TEXT,
+    phone TEXT,
+    is_paid_channel_1 INTEGER DEFAULT 0,  -- Подписка на канал 1
+    is_paid_channel_2 INTEGER DEFAULT 0,  -- Подписка на канал 2
+    payment_date_channel_1 TEXT,  -- Дата оплаты для канала 1
+    payment_date_channel_2 TEXT,  -- Дата оплаты для канала 2
+    subscription_end_date_channel_1 TEXT,  -- Дата окончания подписки для канала 1
+    subscription_end_date_channel_2 TEXT  -- Дата окончания подписки для канала 2
+)
+"""
+
+
+def _channel_columns(channel: int):
+    # Колонки каналов в старой схеме users, нужны только миграциям.
+    # Номер канала подставляется в имя колонки, поэтому проверяем его явно
+    if channel not in (1, 2):
+        raise ValueError(f"Неизвестный канал: {channel}")
+    return f"is_paid_channel_{channel}", f"payment_date_channel_{channel}", f"subscription_end_date_channel_{channel}"
+
+
+def _end_ts_column(channel: int):
+    _channel_columns(channel)
+    return f"subscription_end_ts_channel_{channel}"
+
+
+def _migrate_end_ts(conn: sqlite3.Connection):
+    # Даты окончания в виде epoch-секунд: их можно сравнивать и индексировать,
+    # не разбирая строку strptime на каждой строке
+    for channel in (1, 2):
+        _, _, end_col = _channel_columns(channel)
+        ts_col = _end_ts_column(channel)
+        conn.execute(f"ALTER TABLE users ADD COLUMN {ts_col} INTEGER")
+        rows = conn.execute(f"SELECT id, {end_col} FROM users WHERE {end_col} IS NOT NULL").fetchall()
+        conn.executemany(
+            f"UPDATE users SET {ts_col} = ? WHERE id = ?",
+            [(int(datetime.strptime(end, DATE_FORMAT).timestamp()), user_id) for user_id, end in rows],
+        )
+        # Частичный индекс: в нём только оплаченные подписки канала
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_users_end_ts_channel_{channel} "
+            f"ON users({ts_col}) WHERE is_paid_channel_{channel} = 1"
+        )
+
+
+def _create_sent_reminders(conn: sqlite3.Connection):
+    # Журнал выполненных напоминаний: ключ включает end_ts, поэтому после
+    # продления подписки напоминания о новой дате окончания снова разрешены
+    conn.execute("""
+    CREATE TABLE sent_reminders (
+        user_id INTEGER NOT NULL,
+        channel INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        end_ts INTEGER NOT NULL,
+        sent_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, channel, action, end_ts)
+    )
+    """)
+
+
+def _create_dead_letters(conn: sqlite3.Connection):
+    # Исходящие сообщения, которые не удалось доставить после всех повторов
+    conn.execute("""
+    CREATE TABLE dead_letters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        method TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        error TEXT,
+        attempts INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    """)
+
+
+def _create_fsm_states(conn: sqlite3.Connection):
+    # Состояния FSM (регистрация, пожертвование), переживают перезапуск бота
+    conn.execute("""
+    CREATE TABLE fsm_states (
+        key TEXT PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        updated_at INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE INDEX idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+
+def _create_payments(conn: sqlite3.Connection):
+    # Журнал платежей только на добавление. Уникальный ключ (provider, payment_id)
+    # не даёт повторной доставке одного платежа продлить подписку дважды
+    conn.execute("""
+    CREATE TABLE payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        provider TEXT NOT NULL,
+        payment_id TEXT NOT NULL,
+        user_id INTEGER,
+        payload TEXT,
+        amount INTEGER,  -- В копейках
+        currency TEXT,
+        created_at INTEGER NOT NULL,
+        UNIQUE (provider, payment_id)
+    )
+    """)
+    conn.execute("CREATE INDEX idx_payments_user_id ON payments(user_id)")
+
+
+def _normalize_subscriptions(conn: sqlite3.Connection):
+    # Каналы и подписки — отдельные таблицы вместо колонок *_channel_N в users
+    conn.execute("""
+    CREATE TABLE channels (
+        id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL,
+        price INTEGER NOT NULL,  -- В копейках
+        duration_days INTEGER NOT NULL DEFAULT 30,
+        invite_link TEXT,
+        chat_id INTEGER  -- id закрытого канала в Telegram
+    )
+    """)
+    conn.executemany(
+        "INSERT INTO channels (id, title, price, duration_days, invite_link) VALUES (?, ?, ?, ?, ?)",
+        [
+            (1, "Тренировки с Сэнсэем", 30000, 30, "https://t.me/..."),
+            (2, "Метод ОСС | обучение по исправлению осанки", 300000, 30, "https://t.me/..."),
+        ],
+    )
+    conn.execute("""
+    CREATE TABLE subscriptions (
+        user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        is_active INTEGER NOT NULL DEFAULT 0,
+        payment_ts INTEGER,
+        end_ts INTEGER,
+        PRIMARY KEY (user_id, channel_id)
+    )
+    """)
+    # Проверка окончаний — один запрос по всем каналам; второй индекс для операций по каналу
+    conn.execute("CREATE INDEX idx_subscriptions_end_ts ON subscriptions(end_ts) WHERE is_active = 1")
+    conn.execute("CREATE INDEX idx_subscriptions_channel_end_ts ON subscriptions(channel_id, end_ts) WHERE is_active = 1")
+
+    def to_ts(value):
+        return int(datetime.strptime(value, DATE_FORMAT).timestamp()) if value else None
+
+    for channel in (1, 2):
+        is_paid_col, payment_col, _ = _channel_columns(channel)
+        rows = conn.execute(
+            f"SELECT id, {is_paid_col}, {payment_col}, {_end_ts_column(channel)} FROM users "
+            f"WHERE {is_paid_col} = 1 OR {payment_col} IS NOT NULL OR {_end_ts_column(channel)} IS NOT NULL"
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO subscriptions (user_id, channel_id, is_active, payment_ts, end_ts) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, channel, is_paid or 0, to_ts(payment_date), end_ts)
+             for user_id, is_paid, payment_date, end_ts in rows],
+        )
+
+    # Пересоздаём users без колонок каналов (DROP COLUMN есть не во всех сборках SQLite)
+    conn.execute("""
+    CREATE TABLE users_new (
+        id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT,
+        phone TEXT
+    )
+    """)
+    conn.execute("INSERT INTO users_new (id, username, full_name, phone) SELECT id, username, full_name, phone FROM users")
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_new RENAME TO users")
+
+
+def _create_revocations(conn: sqlite3.Connection):
+    # Очередь и результаты удаления пользователей из каналов после окончания подписки
+    conn.execute("""
+    CREATE TABLE revocations (
+        user_id INTEGER NOT NULL,
+        channel_id INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',  -- pending, done, failed, skipped
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (user_id, channel_id, end_ts)
+    )
+    """)
+    conn.execute("CREATE INDEX idx_revocations_pending ON revocations(updated_at) WHERE status = 'pending'")
+
+
+def _create_locks(conn: sqlite3.Connection):
+    # Блокировки с истечением срока: выбор одного процесса для фоновых задач
+    conn.execute("""
+    CREATE TABLE locks (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at INTEGER NOT NULL
+    )
+    """)
+
+
+def _create_admin_events(conn: sqlite3.Connection):
+    # События для сводки администраторам, не отправленные до остановки бота
+    conn.execute("""
+    CREATE TABLE admin_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,  -- JSON
+        created_at INTEGER NOT NULL
+    )
+    """)
+
+
+def _create_outbox(conn: sqlite3.Connection):
+    # Уведомления пользователям: пишутся в одной транзакции с изменением подписки,
+    # отправляются отдельно; sent_at IS NULL — ещё не отправлено
+    conn.execute("""
+    CREATE TABLE outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        sent_at INTEGER
+    )
+    """)
+    conn.execute("CREATE INDEX idx_outbox_pending ON outbox(id) WHERE sent_at IS NULL")
+
+
+def _create_webhook_inbox(conn: sqlite3.Connection):
+    # Принятые уведомления ЮКассы: записываются до ответа 200 и обрабатываются отдельно,
+    # с повторами после ошибок; одно уведомление о платеже хранится один раз
+    conn.execute("""
+    CREATE TABLE webhook_inbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,
+        object_id TEXT NOT NULL,
+        body BLOB NOT NULL,  -- тело запроса с проверенной подписью
+        created_at INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',  -- pending, done, failed
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        UNIQUE (event, object_id)
+    )
+    """)
+    conn.execute("CREATE INDEX idx_webhook_inbox_pending ON webhook_inbox(next_attempt_at) WHERE status = 'pending'")
+
+
+def _create_generations(conn: sqlite3.Connection):
+    # Счётчики изменений данных, которые опрашивают другие процессы: например, планировщик
+    # лидера собирает очередь заново после массового изменения подписок
+    conn.execute("""
+    CREATE TABLE generations (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+    """)
+
+
+# Миграции схемы по порядку; номер последней применённой хранится в PRAGMA user_version
+MIGRATIONS = [
+    _migrate_end_ts,
+    _create_sent_reminders,
+    _create_dead_letters,
+    _create_fsm_states,
+    _create_payments,
+    _normalize_subscriptions,
+    _create_revocations,
+    _create_locks,
+    _create_admin_events,
+    _create_outbox,
+    _create_webhook_inbox,
+    _create_generations,
+]
+
+
+def payload_channel(payload: str):
+    # Номер канала из payload счёта ("subscription_channel_1") или None для пожертвования
+    if payload and payload.startswith("subscription_channel_"):
+        channel = payload[len("subscription_channel_"):]
+        if channel.isdigit():
+            return int(channel)
+    return None
+
+
+def format_ts(ts):
+    return datetime.fromtimestamp(ts).strftime(DATE_FORMAT) if ts else None
+
+
+def _parse_import_row(row: dict, channels):
+    # Строка файла импорта -> (строка users, строка subscriptions или None)
+    def text(column):
+        return (row.get(column) or "").strip() or None
+
+    def to_ts(column):
+        # DATE_FORMAT — частный случай ISO 8601; fromisoformat на порядок быстрее strptime
+        value = text(column)
+        return int(datetime.fromisoformat(value).timestamp()) if value else None
+
+    user = (int(text("id")), text("username"), text("full_name"), text("phone"))
+    channel = text("channel_id")
+    if channel is None:
+        return user, None
+    channel = int(channel)
+    if channel not in channels:
+        raise ValueError(f"неизвестный канал {channel}")
+    is_paid = 1 if int(text("is_paid") or 0) else 0
+    end_ts = to_ts("subscription_end_date")
+    if is_paid and end_ts is None:
+        # Активная подписка без даты окончания никогда бы не закончилась
+        raise ValueError("у оплаченной подписки не указана subscription_end_date")
+    return user, (user[0], channel, is_paid, to_ts("payment_date"), end_ts)
+
+
+class Database:
+    """Асинхронный доступ к SQLite.
+
+    Все запросы выполняются в небольшом пуле потоков, у каждого потока своё
+    соединение в режиме WAL, поэтому event loop бота не блокируется на fsync.
+    Пользователи и их подписки кэшируются в памяти (UserCache), каналы —
+    на время cache_ttl.
+    """
+
+    def __init__(self, path: str = "users.db", pool_size: int = 4, cache_size: int = 10000,
+                 cache_ttl: float = 300):
+        self.path = path
+        self.pool_size = pool_size
+        self.cache = UserCache(cache_size, cache_ttl)
+        self._channels = None
+        self._channels_expire = 0.0
+        self._executor = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакциями управляем сами через BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    async def _run(self, name: str, fn, *args):
+        # name — метка query в db_query_seconds: имя публичного метода, а не вспомогательной функции
+        if self._executor is None:
+            raise RuntimeError("База данных не открыта, вызовите open()")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._call, fn, args)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, name)
+
+    def _call(self, fn, args):
+        return fn(self._connect(), *args)
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, sql: str, params=()):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(sql, params)
+            conn.execute("COMMIT")
+            return cur.rowcount
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _write_many(conn: sqlite3.Connection, sql: str, rows):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+            return cur.rowcount
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def open(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db")
+        await self._run("open", self._init_schema)
+
+    @staticmethod
+    def _init_schema(conn: sqlite3.Connection):
+        # База уже в актуальной версии: при перезапуске не берём блокировку записи и не выполняем DDL
+        if conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS):
+            return
+        conn.executescript(SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logger.info(f"Применяем миграцию базы данных {number}: {migration.__name__}")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # --- Пользователи ---
+
+    async def get_user(self, user_id: int):
+        user = self.cache.get_user(user_id)
+        if user is None:
+            generation = self.cache.generation
+            user = await self._run(
+                "get_user", self._fetchone, f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)
+            )
+            if user is not None:
+                self.cache.put_user(user, generation)
+        return user
+
+    async def get_users_page(self, after_id: int = None, before_id: int = None, limit: int = 5):
+        # Keyset-пагинация по id: страница не зависит от размера таблицы
+        if before_id is not None:
+            rows = await self._run(
+                "get_users_page", self._fetchall,
+                f"SELECT {USER_COLUMNS} FROM users WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before_id, limit),
+            )
+            return rows[::-1]
+        return await self._run(
+            "get_users_page", self._fetchall,
+            f"SELECT {USER_COLUMNS} FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id if after_id is not None else -1, limit),
+        )
+
+    async def has_users(self, after_id: int = None, before_id: int = None) -> bool:
+        if before_id is not None:
+            sql, params = "SELECT 1 FROM users WHERE id < ? LIMIT 1", (before_id,)
+        else:
+            sql, params = "SELECT 1 FROM users WHERE id > ? LIMIT 1", (after_id if after_id is not None else -1,)
+        return await self._run("has_users", self._fetchone, sql, params) is not None
+
+    async def export_users(self, path: str, fmt: str = "csv") -> int:
+        return await self._run("export_users", self._export_users, path, fmt)
+
+    @staticmethod
+    def _export_users(conn: sqlite3.Connection, path: str, fmt: str) -> int:
+        # Строки читаются курсором по одной и сразу пишутся в файл, поэтому память
+        # не зависит от числа пользователей. Одна строка на подписку; пользователь
+        # без подписок — одна строка с пустыми полями
+        cur = conn.execute(
+            "SELECT u.id, u.username, u.full_name, u.phone, s.channel_id, s.is_active, s.payment_ts, s.end_ts "
+            "FROM users u LEFT JOIN subscriptions s ON s.user_id = u.id ORDER BY u.id, s.channel_id"
+        )
+        columns = EXPORT_COLUMNS
+        count = 0
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f) if fmt != "jsonl" else None
+            if writer:
+                writer.writerow(columns)
+            last_user_id = None
+            for row in cur:
+                if row[0] != last_user_id:
+                    last_user_id = row[0]
+                    count += 1
+                row = row[:6] + (format_ts(row[6]), format_ts(row[7]))
+                if writer:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                    f.write("\n")
+        return count
+
+    async def upsert_user(self, user_id: int, username: str, full_name: str):
+        # Повторный /start обновляет имя и username, остальные поля не трогаем
+        user = await self._run(
+            "upsert_user", self._write_user,
+            "INSERT INTO users (id, username, full_name) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET username = excluded.username, full_name = excluded.full_name",
+            (user_id, username, full_name),
+            user_id,
+        )
+        self.cache.put_user(user)
+
+    async def set_phone(self, user_id: int, phone: str):
+        user = await self._run(
+            "set_phone", self._write_user, "UPDATE users SET phone = ? WHERE id = ?", (phone, user_id), user_id
+        )
+        if user is not None:
+            self.cache.put_user(user)
+        else:
+            self.cache.invalidate(user_id)
+
+    @staticmethod
+    def _write_user(conn: sqlite3.Connection, sql: str, params, user_id: int):
+        # Запись и чтение итоговой строки в одной транзакции — для обновления кэша
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(sql, params)
+            user = conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = ?", (user_id,)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return user
+
+    # --- Каналы ---
+
+    async def get_channels(self):
+        # Каналы меняются редко и вручную: читаем их не чаще раза в cache_ttl
+        if self._channels is None or self._channels_expire < time.monotonic():
+            self._channels = await self._run(
+                "get_channels", self._fetchall, f"SELECT {CHANNEL_COLUMNS} FROM channels ORDER BY id", ()
+            )
+            self._channels_expire = time.monotonic() + self.cache.ttl
+        return self._channels
+
+    async def get_channel(self, channel_id: int):
+        for channel in await self.get_channels():
+            if channel[0] == channel_id:
+                return channel
+        return None
+
+    def invalidate_channels(self):
+        self._channels = None
+
+    # --- Подписки ---
+
+    async def get_user_subscriptions(self, user_id: int):
+        # (channel_id, is_active, payment_ts, end_ts) по всем каналам пользователя
+        subscriptions = self.cache.get_subscriptions(user_id)
+        if subscriptions is None:
+            generation = self.cache.generation
+            subscriptions = await self._run("get_user_subscriptions", self._user_subscriptions, user_id)
+            self.cache.put_subscriptions(user_id, subscriptions, generation)
+        return subscriptions
+
+    async def get_subscriptions_for_users(self, user_ids):
+        rows = await self._run(
+            "get_subscriptions_for_users", self._fetchall,
+            f"SELECT user_id, channel_id, is_active, payment_ts, end_ts FROM subscriptions "
+            f"WHERE user_id IN ({', '.join('?' * len(user_ids))}) ORDER BY user_id, channel_id",
+            tuple(user_ids),
+        )
+        result = {user_id: [] for user_id in user_ids}
+        for user_id, *subscription in rows:
+            result[user_id].append(tuple(subscription))
+        return result
+
+    async def extend_subscription(self, user_id: int, channel: int, days: int = None):
+        result, subscriptions = await self._run(
+            "extend_subscription", self._extend_subscription, user_id, channel, days
+        )
+        self.cache.put_subscriptions(user_id, subscriptions)
+        return result
+
+    @staticmethod
+    def _extend_subscription(conn: sqlite3.Connection, user_id: int, channel: int, days: int):
+        # Чтение и запись в одной транзакции, чтобы параллельные оплаты не потеряли продление
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = Database._extend_in_transaction(conn, user_id, channel, days)
+            subscriptions = Database._user_subscriptions(conn, user_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result, subscriptions
+
+    @staticmethod
+    def _user_subscriptions(conn: sqlite3.Connection, user_id: int):
+        return conn.execute(
+            "SELECT channel_id, is_active, payment_ts, end_ts FROM subscriptions WHERE user_id = ? ORDER BY channel_id",
+            (user_id,),
+        ).fetchall()
+
+    @staticmethod
+    def _extend_in_transaction(conn: sqlite3.Connection, user_id: int, channel: int, days: int = None):
+        if days is None:
+            row = conn.execute("SELECT duration_days FROM channels WHERE id = ?", (channel,)).fetchone()
+            if row is None:
+                raise ValueError(f"Неизвестный канал: {channel}")
+            days = row[0]
+
+        now = datetime.now()
+        row = conn.execute(
+            "SELECT end_ts FROM subscriptions WHERE user_id = ? AND channel_id = ?", (user_id, channel)
+        ).fetchone()
+        current_end = datetime.fromtimestamp(row[0]) if row and row[0] else None
+
+        # Если у пользователя есть активная подписка, продлеваем её
+        if current_end and current_end > now:
+            new_end = current_end + timedelta(days=days)
+        else:
+            new_end = now + timedelta(days=days)
+
+        conn.execute(
+            "INSERT INTO subscriptions (user_id, channel_id, is_active, payment_ts, end_ts) VALUES (?, ?, 1, ?, ?) "
+            "ON CONFLICT(user_id, channel_id) DO UPDATE SET is_active = 1, payment_ts = excluded.payment_ts, "
+            "end_ts = excluded.end_ts",
+            (user_id, channel, int(now.timestamp()), int(new_end.timestamp())),
+        )
+        return now.strftime(DATE_FORMAT), new_end.strftime(DATE_FORMAT), int(new_end.timestamp())
+
+    async def record_payment(self, provider: str, payment_id: str, user_id: int, payload: str,
+                             amount: int, currency: str, days: int = None):
+        # None — платёж уже был обработан; иначе (дата оплаты, дата окончания, end_ts),
+        # для пожертвования даты окончания нет. days=None — срок из настроек канала
+        result, subscriptions = await self._run(
+            "record_payment", self._record_payment, provider, payment_id, user_id, payload, amount, currency, days
+        )
+        if subscriptions is not None:
+            self.cache.put_subscriptions(user_id, subscriptions)
+        return result
+
+    @staticmethod
+    def _record_payment(conn: sqlite3.Connection, provider: str, payment_id: str, user_id: int, payload: str,
+                        amount: int, currency: str, days: int):
+        now = datetime.now()
+        # Запись в журнал и продление подписки — одна транзакция
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO payments (provider, payment_id, user_id, payload, amount, currency, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (provider, payment_id, user_id, payload, amount, currency, int(now.timestamp())),
+            ).rowcount
+            if not inserted:
+                conn.execute("COMMIT")
+                return None, None
+            channel = payload_channel(payload)
+            if channel is not None:
+                result = Database._extend_in_transaction(conn, user_id, channel, days)
+            else:
+                result = (now.strftime(DATE_FORMAT), None, None)
+            # Подписки после продления сразу кладём в кэш: уведомлению администратору
+            # не придётся читать их из базы
+            subscriptions = Database._user_subscriptions(conn, user_id)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return result, subscriptions
+
+    async def get_subscriptions_ending(self, after_ts, until_ts: int):
+        # Активные подписки всех каналов с окончанием в (after_ts, until_ts];
+        # after_ts=None — без нижней границы. Один запрос по индексу idx_subscriptions_end_ts
+        sql = "SELECT user_id, channel_id, end_ts FROM subscriptions WHERE is_active = 1 AND end_ts <= ?"
+        params = [until_ts]
+        if after_ts is not None:
+            sql += " AND end_ts > ?"
+            params.append(after_ts)
+        return await self._run("get_subscriptions_ending", self._fetchall, sql, tuple(params))
+
+    # --- Массовые операции ---
+
+    async def import_users(self, path: str, progress=None, chunk_size: int = 1000):
+        # CSV в формате /get_users_db -> (обработано строк, пользователей, подписок).
+        # progress(строк) вызывается в event loop после каждой записанной пачки
+        loop = asyncio.get_running_loop()
+        report = (lambda rows: loop.call_soon_threadsafe(progress, rows)) if progress is not None else None
+        result = await self._run("import_users", self._import_users, path, report, chunk_size)
+        # Изменено сразу много пользователей: кэш проще сбросить целиком
+        self.cache.clear()
+        return result
+
+    @staticmethod
+    def _import_users(conn: sqlite3.Connection, path: str, progress, chunk_size: int):
+        # Файл читается потоком и пишется пачками executemany, но весь импорт — одна
+        # транзакция: при ошибке в любой строке база не меняется. Пустые поля
+        # пользователя не затирают уже известные значения
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            channels = {row[0] for row in conn.execute("SELECT id FROM channels")}
+            rows = users = subscriptions = 0
+            user_rows, subscription_rows = [], []
+
+            def flush():
+                conn.executemany(
+                    "INSERT INTO users (id, username, full_name, phone) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET username = COALESCE(excluded.username, username), "
+                    "full_name = COALESCE(excluded.full_name, full_name), phone = COALESCE(excluded.phone, phone)",
+                    user_rows,
+                )
+                conn.executemany(
+                    "INSERT INTO subscriptions (user_id, channel_id, is_active, payment_ts, end_ts) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(user_id, channel_id) DO UPDATE SET is_active = excluded.is_active, "
+                    "payment_ts = excluded.payment_ts, end_ts = excluded.end_ts",
+                    subscription_rows,
+                )
+                user_rows.clear()
+                subscription_rows.clear()
+                if progress is not None:
+                    progress(rows)
+
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                reader = csv.DictReader(f)
+                if "id" not in (reader.fieldnames or ()):
+                    raise ValueError(f"Нет колонки id, ожидаются колонки: {', '.join(EXPORT_COLUMNS)}")
+                last_user = None
+                for line, row in enumerate(reader, start=2):
+                    try:
+                        user, subscription = _parse_import_row(row, channels)
+                    except (TypeError, ValueError) as e:
+                        raise ValueError(f"Строка {line}: {e}") from None
+                    # В выгрузке строка на подписку: пользователь повторяется в соседних строках
+                    if user != last_user:
+                        user_rows.append(user)
+                        last_user = user
+                        users += 1
+                    if subscription is not None:
+                        subscription_rows.append(subscription)
+                        subscriptions += 1
+                    rows += 1
+                    if rows % chunk_size == 0:
+                        flush()
+            flush()
+            Database._bump_generation(conn, SUBSCRIPTIONS_GENERATION)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows, users, subscriptions
+
+    async def extend_channel_subscriptions(self, channel_id: int, days: int) -> int:
+        updated = await self._run(
+            "extend_channel_subscriptions", self._extend_channel_subscriptions, channel_id, days * 24 * 60 * 60
+        )
+        if updated:
+            self.cache.clear()
+        return updated
+
+    @staticmethod
+    def _extend_channel_subscriptions(conn: sqlite3.Connection, channel_id: int, seconds: int) -> int:
+        # Продление всех активных подписок канала (например, компенсация за простой) —
+        # один UPDATE по индексу idx_subscriptions_channel_end_ts
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = conn.execute(
+                "UPDATE subscriptions SET end_ts = end_ts + ? WHERE channel_id = ? AND is_active = 1",
+                (seconds, channel_id),
+            ).rowcount
+            if updated:
+                Database._bump_generation(conn, SUBSCRIPTIONS_GENERATION)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return updated
+
+    @staticmethod
+    def _bump_generation(conn: sqlite3.Connection, name: str):
+        # Вызывается внутри транзакции, которая меняет данные
+        conn.execute(
+            "INSERT INTO generations (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    async def get_generation(self, name: str) -> int:
+        row = await self._run("get_generation", self._fetchone, "SELECT value FROM generations WHERE name = ?", (name,))
+        return row[0] if row else 0
+
+    @staticmethod
+    def _segment(segment: str, channel: int = None):
+        if segment not in SEGMENTS:
+            raise ValueError(f"Неизвестный сегмент: {segment}")
+        return SEGMENTS[segment], ((channel,) if segment == "channel" else ())
+
+    async def count_segment(self, segment: str, channel: int = None) -> int:
+        condition, params = self._segment(segment, channel)
+        row = await self._run(
+            "count_segment", self._fetchone, f"SELECT COUNT(*) FROM users u WHERE {condition}", params
+        )
+        return row[0]
+
+    async def iter_segment(self, segment: str, channel: int = None, page_size: int = 1000):
+        # id пользователей сегмента страницами по возрастанию id (keyset): в памяти только
+        # текущая страница, и пользователи, добавленные во время рассылки, тоже попадут в неё
+        condition, params = self._segment(segment, channel)
+        after_id = -1
+        while True:
+            rows = await self._run(
+                "iter_segment", self._fetchall,
+                f"SELECT id FROM users u WHERE id > ? AND {condition} ORDER BY id LIMIT ?",
+                (after_id, *params, page_size),
+            )
+            if not rows:
+                return
+            after_id = rows[-1][0]
+            yield [row[0] for row in rows]
+
+    # --- Удаление из каналов ---
+
+    async def get_pending_revocations(self, limit: int):
+        # (user_id, channel_id, end_ts, chat_id канала, attempts, renewed); renewed = 1, если
+        # подписку продлили после окончания, из-за которого поставлена задача
+        return await self._run(
+            "get_pending_revocations", self._fetchall,
+            "SELECT r.user_id, r.channel_id, r.end_ts, c.chat_id, r.attempts, "
+            "COALESCE(s.is_active = 1 AND s.end_ts > r.end_ts, 0) FROM revocations r "
+            "LEFT JOIN channels c ON c.id = r.channel_id "
+            "LEFT JOIN subscriptions s ON s.user_id = r.user_id AND s.channel_id = r.channel_id "
+            "WHERE r.status = 'pending' ORDER BY r.updated_at LIMIT ?",
+            (limit,),
+        )
+
+    async def save_revocation_results(self, results):
+        # results: (user_id, channel_id, end_ts, status, attempts, error)
+        now = int(datetime.now().timestamp())
+        await self._run(
+            "save_revocation_results", self._write_many,
+            "UPDATE revocations SET status = ?, attempts = ?, error = ?, updated_at = ? "
+            "WHERE user_id = ? AND channel_id = ? AND end_ts = ?",
+            [(status, attempts, error, now, user_id, channel_id, end_ts)
+             for user_id, channel_id, end_ts, status, attempts, error in results],
+        )
+
+    # --- Напоминания и окончания подписок ---
+
+    async def apply_reminders(self, reminders, expire_action: str):
+        # reminders: (user_id, channel, action, end_ts, текст уведомления или None).
+        # Возвращает (user_id, channel, action, end_ts) выполненных событий
+        applied = await self._run(
+            "apply_reminders", self._apply_reminders, reminders, expire_action, int(datetime.now().timestamp())
+        )
+        for user_id, channel, action, _ in applied:
+            if action == expire_action:
+                self.cache.invalidate_subscriptions(user_id)
+        return applied
+
+    @staticmethod
+    def _apply_reminders(conn: sqlite3.Connection, reminders, expire_action: str, now: int):
+        # Вся пачка — одна транзакция: отметка о выполнении, снятие оплаты, очередь
+        # удаления из канала и уведомления либо записываются вместе, либо никак
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Событие актуально, если подписку не продлили и не закрыли и оно ещё не выполнялось
+            due = [
+                (user_id, channel, action, end_ts, text)
+                for user_id, channel, action, end_ts, text in reminders
+                if conn.execute(
+                    "SELECT 1 FROM subscriptions s WHERE s.user_id = ? AND s.channel_id = ? AND s.is_active = 1 "
+                    "AND s.end_ts = ? AND NOT EXISTS (SELECT 1 FROM sent_reminders r WHERE r.user_id = s.user_id "
+                    "AND r.channel = s.channel_id AND r.action = ? AND r.end_ts = s.end_ts)",
+                    (user_id, channel, end_ts, action),
+                ).fetchone()
+            ]
+            expired = [(user_id, channel, end_ts) for user_id, channel, action, end_ts, _ in due if action == expire_action]
+            conn.executemany(
+                "INSERT INTO sent_reminders (user_id, channel, action, end_ts, sent_at) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, channel, action, end_ts, now) for user_id, channel, action, end_ts, _ in due],
+            )
+            conn.executemany(
+                "UPDATE subscriptions SET is_active = 0 WHERE user_id = ? AND channel_id = ? AND end_ts = ?", expired
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO revocations (user_id, channel_id, end_ts, updated_at) VALUES (?, ?, ?, ?)",
+                [(user_id, channel, end_ts, now) for user_id, channel, end_ts in expired],
+            )
+            conn.executemany(
+                "INSERT INTO outbox (chat_id, text, created_at) VALUES (?, ?, ?)",
+                [(user_id, text, now) for user_id, _, _, _, text in due if text is not None],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(user_id, channel, action, end_ts) for user_id, channel, action, end_ts, _ in due]
+
+    # --- Блокировки ---
+
+    async def acquire_lock(self, name: str, owner: str, ttl: int) -> bool:
+        # Захватывает или продлевает блокировку; чужую — только если её срок истёк
+        now = int(time.time())
+        return await self._run(
+            "acquire_lock", self._write,
+            "INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE locks.owner = excluded.owner OR locks.expires_at < ?",
+            (name, owner, now + ttl, now),
+        ) > 0
+
+    async def release_lock(self, name: str, owner: str):
+        await self._run("release_lock", self._write, "DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    # --- Сводка для администраторов ---
+
+    async def save_admin_events(self, events):
+        await self._run(
+            "save_admin_events", self._write_many,
+            "INSERT INTO admin_events (event, created_at) VALUES (?, ?)",
+            [(json.dumps(event, ensure_ascii=False), event["ts"]) for event in events],
+        )
+
+    async def take_admin_events(self):
+        # Чтение и удаление в одной транзакции: при нескольких процессах события забирает один
+        rows = await self._run("take_admin_events", self._take_admin_events)
+        return [json.loads(row[0]) for row in rows]
+
+    @staticmethod
+    def _take_admin_events(conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT event FROM admin_events ORDER BY id").fetchall()
+            conn.execute("DELETE FROM admin_events")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    # --- Исходящие сообщения ---
+
+    async def get_pending_notifications(self, limit: int):
+        # (id, chat_id, text) в порядке постановки
+        return await self._run(
+            "get_pending_notifications", self._fetchall,
+            "SELECT id, chat_id, text FROM outbox WHERE sent_at IS NULL ORDER BY id LIMIT ?", (limit,),
+        )
+
+    async def mark_notifications_sent(self, ids):
+        now = int(datetime.now().timestamp())
+        await self._run(
+            "mark_notifications_sent", self._write_many,
+            "UPDATE outbox SET sent_at = ? WHERE id = ?", [(now, i) for i in ids],
+        )
+
+    async def add_dead_letter(self, chat_id: int, method: str, payload: str, error: str, attempts: int):
+        await self._run(
+            "add_dead_letter", self._write,
+            "INSERT INTO dead_letters (chat_id, method, payload, error, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, method, payload, error, attempts, int(datetime.now().timestamp())),
+        )
+
+    # --- Уведомления ЮКассы ---
+
+    async def add_webhook_events(self, events):
+        # events: (event, object_id, тело запроса); уже записанные уведомления пропускаются
+        now = int(datetime.now().timestamp())
+        await self._run(
+            "add_webhook_events", self._write_many,
+            "INSERT OR IGNORE INTO webhook_inbox (event, object_id, body, created_at) VALUES (?, ?, ?, ?)",
+            [(event, object_id, body, now) for event, object_id, body in events],
+        )
+
+    async def get_due_webhook_events(self, limit: int):
+        # (id, event, body, attempts) необработанных уведомлений, срок повтора которых наступил
+        return await self._run(
+            "get_due_webhook_events", self._fetchall,
+            "SELECT id, event, body, attempts FROM webhook_inbox WHERE status = 'pending' AND next_attempt_at <= ? "
+            "ORDER BY id LIMIT ?",
+            (int(datetime.now().timestamp()), limit),
+        )
+
+    async def save_webhook_results(self, results):
+        # results: (id, status, attempts, next_attempt_at, error)
+        await self._run(
+            "save_webhook_results", self._write_many,
+            "UPDATE webhook_inbox SET status = ?, attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?",
+            [(status, attempts, next_attempt_at, error, event_id)
+             for event_id, status, attempts, next_attempt_at, error in results],
+        )
+
+    # --- Состояния FSM ---
+
+    async def get_fsm_record(self, key: str):
+        return await self._run(
+            "get_fsm_record", self._fetchone, "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        )
+
+    async def save_fsm_records(self, upserts, deletes):
+        await self._run("save_fsm_records", self._save_fsm_records, upserts, deletes)
+
+    @staticmethod
+    def _save_fsm_records(conn: sqlite3.Connection, upserts, deletes):
+        # Все накопленные изменения — одной транзакцией
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                upserts,
+            )
+            conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def delete_fsm_records_older_than(self, ts: int) -> int:
+        return await self._run(
+            "delete_fsm_records_older_than", self._write, "DELETE FROM fsm_states WHERE updated_at < ?", (ts,)
+        )
+
+    # --- Вспомогательные ---
+
+    @staticmethod
+    def _fetchone(conn: sqlite3.Connection, sql: str, params):
+        return conn.execute(sql, params).fetchone()
+
+    @staticmethod
+    def _fetchall(conn: sqlite3.Connection, sql: str, params):
+        return conn.execute(sql, params).fetchall()
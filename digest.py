@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+PAYMENT = "payment"
+EXPIRED = "expired"
+REVOKE_FAILED = "revoke_failed"
+
+# Лимит Telegram на длину сообщения — 4096 символов, оставляем запас
+MAX_MESSAGE_LENGTH = 3500
+# Сколько записей показывать в каждом списке сводки и максимальная длина записи
+MAX_ITEMS = 10
+MAX_ITEM_LENGTH = 150
+
+
+def _payment_text(event: dict) -> str:
+    payment_type = "пожертвование" if event["channel"] is None else f"канал {event['channel']}"
+    return f"{payment_type}, {event['amount'] / 100:.2f} {event['currency']}"
+
+
+class AdminDigest:
+    """Сводка событий для администраторов вместо сообщения на каждое событие.
+
+    Оплаты, окончания подписок и неудачные удаления из каналов копятся в
+    памяти и отправляются одним сообщением раз в interval секунд или сразу
+    после max_events событий. При остановке накопленное сохраняется в
+    таблицу admin_events и попадает в следующую сводку после запуска.
+    Оплаты от alert_amount копеек дополнительно уходят сразу через on_alert.
+
+    При нескольких процессах сводку отправляет только тот, для которого
+    is_sender() истинно; остальные вместо отправки сохраняют события в
+    admin_events, откуда их забирает отправитель.
+    """
+
+    def __init__(self, db, sender, admin_ids, interval: float = 600, max_events: int = 100,
+                 alert_amount: int = 0, on_alert=None, is_sender=None):
+        self.db = db
+        self.sender = sender
+        self.admin_ids = admin_ids
+        self.interval = interval
+        self.max_events = max_events
+        self.alert_amount = alert_amount
+        # Вызывается с событием оплаты, если её сумма не меньше alert_amount
+        self.on_alert = on_alert
+        self.is_sender = is_sender
+        self._events = []
+        self._full = asyncio.Event()
+        self._task = None
+
+    def _add(self, event: dict):
+        event["ts"] = int(time.time())
+        self._events.append(event)
+        if len(self._events) >= self.max_events:
+            self._full.set()
+
+    async def add_payment(self, user_id: int, channel, amount: int, currency: str, payment_date: str):
+        # channel=None — пожертвование; amount в копейках
+        event = {"kind": PAYMENT, "user_id": user_id, "channel": channel, "amount": amount,
+                 "currency": currency, "payment_date": payment_date}
+        self._add(event)
+        if self.alert_amount and amount >= self.alert_amount and self.on_alert is not None:
+            try:
+                await self.on_alert(event)
+            except Exception as e:
+                logger.error(f"Ошибка срочного уведомления об оплате пользователя {user_id}: {e}")
+
+    def add_expired(self, user_id: int, channel: int):
+        self._add({"kind": EXPIRED, "user_id": user_id, "channel": channel})
+
+    def add_revoke_failed(self, user_id: int, channel: int, error: str):
+        self._add({"kind": REVOKE_FAILED, "user_id": user_id, "channel": channel, "error": error})
+
+    async def _user_line(self, user_id: int) -> str:
+        user = await self.db.get_user(user_id)
+        if user is None:
+            return f"{user_id}"
+        _, username, full_name, _ = user
+        return f"{full_name} (@{username if username else 'N/A'}, {user_id})"
+
+    async def _items(self, title: str, events, describe):
+        # Список по пользователям: не больше MAX_ITEMS записей, остальные — одной строкой
+        lines = ["", title]
+        for event in events[:MAX_ITEMS]:
+            line = f"• {await self._user_line(event['user_id'])} — {describe(event)}"
+            if len(line) > MAX_ITEM_LENGTH:
+                line = line[:MAX_ITEM_LENGTH - 1] + "…"
+            lines.append(line)
+        if len(events) > MAX_ITEMS:
+            lines.append(f"… и ещё {len(events) - MAX_ITEMS}")
+        return lines
+
+    async def render(self, events) -> str:
+        since = min(event["ts"] for event in events)
+        period = f"{datetime.fromtimestamp(since):%d.%m %H:%M} – {datetime.now():%d.%m %H:%M}"
+        lines = [f"Сводка за {period}", ""]
+        payments = [event for event in events if event["kind"] == PAYMENT]
+        expired = [event for event in events if event["kind"] == EXPIRED]
+        failed = [event for event in events if event["kind"] == REVOKE_FAILED]
+
+        # Сначала итоги всех разделов: они видны, сколько бы ни было событий
+        if payments:
+            totals = Counter()
+            for event in payments:
+                totals[event["currency"]] += event["amount"]
+            total_text = ", ".join(f"{amount / 100:.2f} {currency}" for currency, amount in totals.items())
+            lines.append(f"Оплаты: {len(payments)} на сумму {total_text}")
+            by_channel = Counter(event["channel"] for event in payments)
+            for channel, count in sorted(by_channel.items(), key=lambda item: (item[0] is None, item[0] or 0)):
+                lines.append(f"  {'Пожертвования' if channel is None else f'Канал {channel}'}: {count}")
+        if expired:
+            by_channel = Counter(event["channel"] for event in expired)
+            lines.append(f"Истекло подписок: {len(expired)} ("
+                         + ", ".join(f"канал {channel}: {count}" for channel, count in sorted(by_channel.items())) + ")")
+        if failed:
+            lines.append(f"Не удалось удалить из канала, нужно удалить вручную: {len(failed)}")
+
+        # Затем списки по пользователям, каждый со своим ограничением
+        if failed:
+            lines += await self._items("Удалить вручную:", failed,
+                                       lambda event: f"канал {event['channel']}: {event['error']}")
+        if payments:
+            lines += await self._items("Оплаты:", payments, _payment_text)
+
+        text = "\n".join(lines)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            # Итоги в начале, поэтому обрезается только конец списков
+            text = text[:MAX_MESSAGE_LENGTH].rsplit("\n", 1)[0] + "\n…"
+        return text
+
+    async def flush(self):
+        events, self._events = self._events, []
+        self._full.clear()
+        try:
+            if self.is_sender is not None and not self.is_sender():
+                if events:
+                    await self.db.save_admin_events(events)
+                return
+            # События других процессов и сохранённые при прошлой остановке
+            events = await self.db.take_admin_events() + events
+            if not events:
+                return
+            text = await self.render(events)
+        except BaseException:
+            # Не теряем события (в том числе при остановке посреди сброса): попадут в следующую сводку
+            self._events = events + self._events
+            raise
+        for admin_id in self.admin_ids:
+            self.sender.send_message(admin_id, text)
+        logger.info(f"Отправлена сводка администраторам: {len(events)} событий")
+
+    async def _loop(self):
+        while True:
+            # asyncio.wait, а не wait_for: wait_for в 3.11 может проглотить отмену,
+            # если событие наступило одновременно с остановкой
+            waiter = asyncio.ensure_future(self._full.wait())
+            try:
+                await asyncio.wait([waiter], timeout=self.interval)
+            finally:
+                waiter.cancel()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки администраторам: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._events:
+            events, self._events = self._events, []
+            await self.db.save_admin_events(events)
+            logger.info(f"Сохранено событий для сводки: {len(events)}")
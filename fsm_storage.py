@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(part) for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ))
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в базе бота с отложенной записью.
+
+    Состояния читаются из кэша в памяти, изменения сбрасываются в таблицу
+    fsm_states пачкой раз в flush_interval секунд. Брошенные состояния
+    старше ttl удаляются. Кэш принадлежит процессу, поэтому при нескольких
+    воркерах апдейты одного пользователя должны попадать в один процесс.
+    """
+
+    def __init__(self, db, ttl: int = 24 * 60 * 60, flush_interval: float = 1.0):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # ключ -> [состояние, данные, время последнего изменения]
+        self._cache = {}
+        self._dirty = set()
+        self._task = None
+        self._last_eviction = time.time()
+
+    async def _record(self, key: StorageKey):
+        storage_key = _key(key)
+        record = self._cache.get(storage_key)
+        if record is None:
+            row = await self.db.get_fsm_record(storage_key)
+            if row is not None and row[2] >= time.time() - self.ttl:
+                record = [row[0], json.loads(row[1]) if row[1] else {}, row[2]]
+            else:
+                record = [None, {}, time.time()]
+            # Пока ждали базу, запись могла появиться из другого апдейта
+            record = self._cache.setdefault(storage_key, record)
+        return storage_key, record
+
+    def _touch(self, storage_key: str, record: list):
+        record[2] = time.time()
+        self._dirty.add(storage_key)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key, record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(storage_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, record = await self._record(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key, record = await self._record(key)
+        record[1] = data.copy()
+        self._touch(storage_key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, record = await self._record(key)
+        return record[1].copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for storage_key in dirty:
+            state, data, updated_at = self._cache[storage_key]
+            if state is None and not data:
+                # Пустое состояние (state.clear()) в базе не храним
+                deletes.append((storage_key,))
+            else:
+                upserts.append((storage_key, state, json.dumps(data, ensure_ascii=False), int(updated_at)))
+        try:
+            await self.db.save_fsm_records(upserts, deletes)
+        except Exception:
+            # Не теряем изменения: вернём их в следующий сброс
+            self._dirty |= dirty
+            raise
+
+    def _evict_cache(self, older_than: float):
+        for storage_key in [k for k, record in self._cache.items() if record[2] < older_than]:
+            if storage_key not in self._dirty:
+                del self._cache[storage_key]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                now = time.time()
+                if now - self._last_eviction >= min(self.ttl, 60 * 60):
+                    self._last_eviction = now
+                    self._evict_cache(now - self.ttl)
+                    evicted = await self.db.delete_fsm_records_older_than(int(now - self.ttl))
+                    if evicted:
+                        logger.info(f"Удалено брошенных FSM-состояний: {evicted}")
+            except Exception as e:
+                logger.error(f"Ошибка записи FSM-состояний: {e}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
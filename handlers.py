@@ -0,0 +1,538 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+from aiogram import Bot, F, Router, types
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, Message, ReplyKeyboardMarkup
+
+import config
+from broadcast import Broadcast
+from database import SEGMENTS, format_ts, payload_channel
+from revocation import DONE
+from scheduler import EXPIRE, REMIND_1_DAY, REMIND_3_DAYS, Reminder
+
+if TYPE_CHECKING:
+    from application import Application
+
+logger = logging.getLogger(__name__)  # Создаем объект logger
+
+USERS_PAGE_SIZE = 5
+
+PROGRESS_INTERVAL = 3  # Как часто (в секундах) обновлять сообщение о ходе долгой операции
+
+BROADCAST_USAGE = (
+    "Использование: /broadcast <сегмент> <текст>\n"
+    "Сегменты: all — все пользователи, active — с активной подпиской, "
+    "inactive — без активной подписки, номер канала — активные подписчики канала"
+)
+
+# Форматирование записи пользователя для администратора
+def format_user(user, subscriptions, channels) -> str:
+    user_id, username, full_name, phone = user
+    by_channel = {channel_id: (is_active, payment_ts, end_ts) for channel_id, is_active, payment_ts, end_ts in subscriptions}
+    lines = [
+        f"ID: {user_id}",
+        f"Имя: {full_name}",
+        f"Username: @{username if username else 'N/A'}",
+        f"Телефон: {phone if phone else 'N/A'}",
+    ]
+    for channel_id, title, *_ in channels:
+        is_active, payment_ts, end_ts = by_channel.get(channel_id, (0, None, None))
+        lines.append(f"Статус оплаты канал {channel_id} ({title}): {'Оплачено ✅' if is_active else 'Не оплачено ❌'}")
+        lines.append(f"Дата оплаты канал {channel_id}: {format_ts(payment_ts) or 'N/A'}")
+        lines.append(f"Дата окончания подписки канал {channel_id}: {format_ts(end_ts) or 'N/A'}")
+    lines.append("-----------------------------")
+    return "\n".join(lines)
+
+# Команда /get_users_db [csv|jsonl] — выгрузка базы одним файлом
+async def send_users_db(message: Message, command: CommandObject, app: "Application"):
+    # Проверяем, есть ли пользователь в списке администраторов
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in ("csv", "jsonl"):
+        await message.answer("Формат выгрузки: /get_users_db csv или /get_users_db jsonl")
+        return
+
+    # Пишем выгрузку во временный файл построчно и отправляем одним документом
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await app.db.export_users(path, fmt)
+        if not count:
+            await message.answer("В базе данных нет пользователей.")
+            return
+        filename = f"users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"Пользователей: {count}")
+    finally:
+        os.remove(path)
+
+# Страница списка пользователей с кнопками навигации
+async def build_users_page(app: "Application", after_id: int = None, before_id: int = None):
+    users = await app.db.get_users_page(after_id=after_id, before_id=before_id, limit=USERS_PAGE_SIZE)
+    if not users:
+        return None, None
+
+    first_id, last_id = users[0][0], users[-1][0]
+    subscriptions = await app.db.get_subscriptions_for_users([user[0] for user in users])
+    channels = await app.db.get_channels()
+    buttons = []
+    if await app.db.has_users(before_id=first_id):
+        buttons.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"users_page:prev:{first_id}"))
+    if await app.db.has_users(after_id=last_id):
+        buttons.append(InlineKeyboardButton(text="Вперёд ▶️", callback_data=f"users_page:next:{last_id}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return "\n".join(format_user(user, subscriptions[user[0]], channels) for user in users), keyboard
+
+# Команда /users — просмотр базы постранично
+async def users_page_handler(message: Message, app: "Application"):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    text, keyboard = await build_users_page(app)
+    if text is None:
+        await message.answer("В базе данных нет пользователей.")
+        return
+    await message.answer(text, reply_markup=keyboard)
+
+# Листание страниц списка пользователей
+async def users_page_callback(callback: CallbackQuery, app: "Application"):
+    if callback.from_user.id not in config.ADMIN_IDS:
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    _, direction, anchor_id = callback.data.split(":")
+    if direction == "next":
+        text, keyboard = await build_users_page(app, after_id=int(anchor_id))
+    else:
+        text, keyboard = await build_users_page(app, before_id=int(anchor_id))
+    if text is not None:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
+
+# Сообщение администратору о ходе долгой операции: правится раз в interval секунд
+# и только если текст изменился, чтобы не упереться в лимиты Telegram
+class ProgressMessage:
+    def __init__(self, message: Message, render, interval: float = PROGRESS_INTERVAL):
+        self.message = message
+        self.render = render
+        self.interval = interval
+        self._sent = None
+        self._text = None
+        self._task = None
+
+    async def show(self, text: str):
+        if text == self._text:
+            return
+        self._text = text
+        try:
+            if self._sent is None:
+                self._sent = await self.message.answer(text)
+            else:
+                await self._sent.edit_text(text)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение о ходе операции: {e}")
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.show(self.render())
+
+    async def __aenter__(self):
+        await self.show(self.render())
+        self._task = asyncio.create_task(self._loop())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+# Команда /import_users — CSV в формате /get_users_db, присланный документом с этой подписью
+async def import_users_handler(message: Message, bot: Bot, app: "Application"):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    if message.document is None:
+        await message.answer("Пришлите CSV-файл в формате /get_users_db с подписью /import_users")
+        return
+    # Импорт идёт в фоне, обработчик не держит воркер апдейтов
+    app.spawn(run_import(message, bot, app))
+
+async def run_import(message: Message, bot: Bot, app: "Application"):
+    rows = 0
+
+    def on_progress(done: int):
+        nonlocal rows
+        rows = done
+
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        async with ProgressMessage(message, lambda: f"Импорт: обработано строк {rows}") as progress:
+            try:
+                total, users, subscriptions = await app.db.import_users(path, on_progress)
+            except ValueError as e:
+                await progress.show(f"Импорт отменён, база не изменена. {e}")
+                return
+            logger.info(f"Импорт пользователей: строк {total}, пользователей {users}, подписок {subscriptions}")
+            await progress.show(f"Импорт завершён: строк {total}, пользователей {users}, подписок {subscriptions}.")
+    except Exception as e:
+        logger.error(f"Ошибка импорта пользователей: {e}")
+        await message.answer(f"Ошибка импорта, база не изменена: {e}")
+    finally:
+        os.remove(path)
+
+# Команда /extend_channel <id канала> <дней> — продлить все активные подписки канала
+async def extend_channel_handler(message: Message, command: CommandObject, app: "Application"):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    args = (command.args or "").split()
+    if len(args) != 2 or not all(arg.isdigit() for arg in args) or int(args[1]) == 0:
+        await message.answer("Использование: /extend_channel <id канала> <дней>")
+        return
+    channel_id, days = int(args[0]), int(args[1])
+    channel = await app.db.get_channel(channel_id)
+    if channel is None:
+        await message.answer(f"Канал {channel_id} не найден.")
+        return
+
+    updated = await app.db.extend_channel_subscriptions(channel_id, days)
+    logger.info(f"Подписки на канал {channel_id} продлены на {days} дн.: {updated}")
+    await message.answer(f"Подписки на канал {channel_id} ({channel[1]}) продлены на {days} дн.: {updated} подписчиков.")
+
+# Команда /broadcast <сегмент> <текст> — рассылка через общую очередь отправки
+async def broadcast_handler(message: Message, command: CommandObject, app: "Application"):
+    if message.from_user.id not in config.ADMIN_IDS:
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+
+    parts = (command.args or "").split(maxsplit=1)
+    if len(parts) != 2:
+        await message.answer(BROADCAST_USAGE)
+        return
+    segment, text = parts
+    channel = None
+    if segment.isdigit():
+        channel, segment = int(segment), "channel"
+        if await app.db.get_channel(channel) is None:
+            await message.answer(f"Канал {channel} не найден.")
+            return
+    elif segment not in SEGMENTS or segment == "channel":
+        await message.answer(BROADCAST_USAGE)
+        return
+    app.spawn(run_broadcast(message, Broadcast(app.db, app.sender, text, segment, channel, window=config.BROADCAST_WINDOW)))
+
+async def run_broadcast(message: Message, broadcast: Broadcast):
+    def render():
+        total = broadcast.total if broadcast.total is not None else "?"
+        return f"Рассылка: отправлено {broadcast.sent} из {total}, не доставлено {broadcast.failed}"
+
+    try:
+        async with ProgressMessage(message, render) as progress:
+            await broadcast.run()
+            await progress.show(f"Рассылка завершена: отправлено {broadcast.sent}, не доставлено {broadcast.failed}.")
+    except Exception as e:
+        logger.error(f"Ошибка рассылки: {e}")
+        await message.answer(f"Рассылка прервана из-за ошибки: {e}. Отправлено {broadcast.sent}.")
+
+# Определяем состояния
+class UserState(StatesGroup):
+    waiting_for_name = State()
+    waiting_for_contact = State()
+    waiting_for_donation_amount = State()
+
+# Кнопки для ввода номера телефона
+contact_button = KeyboardButton(text="Поделиться номером телефона", request_contact=True)
+contact_keyboard = ReplyKeyboardMarkup(keyboard=[[contact_button]], resize_keyboard=True)
+
+# Команда /start
+async def start_handler(message: Message, state: FSMContext):
+    user_id = message.from_user.id
+    await message.answer("Привет! Давай начнем. Как тебя зовут?")
+    await state.set_state(UserState.waiting_for_name)
+
+# Обработка имени пользователя
+async def name_handler(message: Message, state: FSMContext, app: "Application"):
+    full_name = message.text
+    user_id = message.from_user.id
+    username = message.from_user.username
+
+    # Сохраняем имя в базу
+    await app.db.upsert_user(user_id, username, full_name)
+
+    await message.answer(
+        "Спасибо! Теперь поделись своим номером телефона с помощью кнопки ниже или в формате +79991234567.",
+        reply_markup=contact_keyboard
+    )
+    await state.set_state(UserState.waiting_for_contact)
+
+# Обработка номера телефона через кнопку "Поделиться номером телефона"
+async def contact_handler(message: Message, state: FSMContext, app: "Application"):
+    phone = message.contact.phone_number
+    user_id = message.from_user.id
+
+    # Сохраняем номер телефона в базу
+    await app.db.set_phone(user_id, phone)
+
+    await send_payment_prompt(message, state, app)
+
+# Обработка номера телефона, введенного вручную
+async def manual_phone_handler(message: Message, state: FSMContext, app: "Application"):
+    phone = message.text.strip()
+
+    # Проверяем, является ли текст корректным номером телефона
+    if not re.fullmatch(r"^\+?\d{10,15}$", phone):  # Номер телефона должен содержать от 10 до 15 цифр
+        await message.answer(
+            "Пожалуйста, введите корректный номер телефона в международном формате (например, +79991234567)."
+        )
+        return
+
+    user_id = message.from_user.id
+
+    # Сохраняем номер телефона в базу
+    await app.db.set_phone(user_id, phone)
+
+    await send_payment_prompt(message, state, app)
+
+# Функция отправки сообщения с предложением оплатить подписку
+async def send_payment_prompt(message: Message, state: FSMContext, app: "Application"):
+    # Кнопки для выбора типа платежа: по одной на каждый канал из таблицы channels
+    pay_buttons = [
+        [InlineKeyboardButton(text=f"Оплатить канал {channel_id} [{price // 100} руб]", callback_data=f"pay_channel_{channel_id}")]
+        for channel_id, title, price, *_ in await app.db.get_channels()
+    ]
+    donate_button = InlineKeyboardButton(text="Сделать пожертвование", callback_data="donate")
+    pay_keyboard = InlineKeyboardMarkup(inline_keyboard=pay_buttons + [[donate_button]])
+    
+    await message.answer(
+        "Спасибо! Выберите тип платежа:",
+        reply_markup=pay_keyboard
+    )
+    await state.clear()  # Сбрасываем состояние
+
+# Обработка выбора типа платежа
+async def payment_handler(callback: CallbackQuery, bot: Bot, app: "Application"):
+    channel_id = callback.data[len("pay_channel_"):]
+    channel = await app.db.get_channel(int(channel_id)) if channel_id.isdigit() else None
+    if channel is None:
+        await callback.answer("Канал не найден.")
+        return
+
+    channel_id, title, price, *_ = channel
+    prices = [types.LabeledPrice(label=f"Подписка на канал {channel_id}", amount=price)]  # Цена в копейках
+    payload = f"subscription_channel_{channel_id}"
+
+    await bot.send_invoice(
+        chat_id=callback.from_user.id,
+        title="Подписка на канал",
+        description="Оплата доступа к закрытому каналу",
+        provider_token=config.PAYMENT_PROVIDER_TOKEN,
+        currency="RUB",
+        prices=prices,
+        payload=payload,
+    )
+    await callback.answer()  # Закрываем всплывающее уведомление
+
+# Обработка пожертвования
+async def donate_handler(callback: CallbackQuery, state: FSMContext):
+    await callback.message.answer("Введите сумму пожертвования в рублях:")
+    await state.set_state(UserState.waiting_for_donation_amount)
+    await callback.answer()
+
+# Обработка ввода суммы пожертвования
+async def process_donation_amount(message: Message, state: FSMContext, bot: Bot):
+    try:
+        amount_rub = float(message.text)  # Преобразуем ввод в число
+        if amount_rub < 60:  # Минимальная сумма — 60 рублей
+            await message.answer("Минимальная сумма пожертвования — 60 рублей.")
+            return
+        amount = int(amount_rub * 100)  # Переводим рубли в копейки
+
+        prices = [types.LabeledPrice(label="Пожертвование", amount=amount)]
+        
+        await bot.send_invoice(
+            chat_id=message.from_user.id,
+            title="Пожертвование",
+            description="Спасибо за вашу поддержку!",
+            provider_token=config.PAYMENT_PROVIDER_TOKEN,
+            currency="RUB",
+            prices=prices,
+            payload="donation"
+        )
+        await state.clear()
+    except ValueError:
+        await message.answer("Пожалуйста, введите корректную сумму.")
+
+async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery, bot: Bot):
+    await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
+
+# Обработка успешной оплаты
+async def successful_payment_handler(message: Message, bot: Bot, app: "Application"):
+    logger.info("Успешный платеж получен!")
+    user_id = message.from_user.id
+    payload = message.successful_payment.invoice_payload
+
+    # Логируем информацию о платеже
+    logger.info(f"Пользователь {user_id} оплатил: {payload}")
+
+    # Записываем платёж в журнал и в той же транзакции продлеваем подписку.
+    # Повторная доставка того же платежа ничего не меняет
+    payment = message.successful_payment
+    result = await app.db.record_payment(
+        "telegram", payment.telegram_payment_charge_id, user_id, payload, payment.total_amount, payment.currency
+    )
+    if result is None:
+        logger.warning(f"Платеж {payment.telegram_payment_charge_id} уже обработан, повтор пропущен")
+        return
+    payment_date, new_subscription_end, new_subscription_end_ts = result
+
+    channel_id = payload_channel(payload)
+    channel = await app.db.get_channel(channel_id) if channel_id is not None else None
+    if channel is not None:
+        channel_id, title, _, _, invite_link, chat_id = channel
+        invite_link = await create_invite_link(bot, user_id, chat_id, invite_link)
+        app.scheduler.schedule_subscription(user_id, channel_id, new_subscription_end_ts)
+        logger.info(f"Пользователь {user_id} подписан на Канал {channel_id} ({title})")
+        await message.answer(f"Ваша подписка на канал {channel_id} продлена до {new_subscription_end}.")
+        await message.answer(
+            f"Оплата прошла успешно! Добро пожаловать в канал {channel_id}. Перейди по ссылке, чтобы присоединиться:",
+            reply_markup=types.InlineKeyboardMarkup(
+                inline_keyboard=[
+                    [types.InlineKeyboardButton(text=f"Присоединиться к канал {channel_id}", url=invite_link)]
+                ]
+            )
+        )
+    elif payload == "donation":
+        logger.info(f"Пользователь {user_id} сделал пожертвование")
+        await message.answer("Спасибо за ваше пожертвование! Ваша поддержка очень важна для нас.")
+
+    # Оплата попадает в сводку для администраторов (крупная — ещё и сразу)
+    await app.digest.add_payment(user_id, payload_channel(payload), payment.total_amount, payment.currency, payment_date)
+
+# Одноразовая ссылка-приглашение для пользователя; если chat_id канала не задан
+# или создать ссылку не удалось, используется общая ссылка канала
+async def create_invite_link(bot: Bot, user_id: int, chat_id: int, default_link: str) -> str:
+    if chat_id is None:
+        return default_link
+    try:
+        link = await bot.create_chat_invite_link(
+            chat_id,
+            name=f"user {user_id}",
+            expire_date=datetime.now() + timedelta(hours=config.INVITE_LINK_TTL_HOURS),
+            member_limit=1,
+        )
+        return link.invite_link
+    except Exception as e:
+        logger.error(f"Не удалось создать ссылку-приглашение для пользователя {user_id}: {e}")
+        return default_link
+
+# Срочное уведомление администратору о крупной оплате (событие из AdminDigest).
+# direct=True — через бота напрямую, для процесса без запущенной очереди отправки (супервизор)
+async def notify_admin(app: "Application", event: dict, direct: bool = False):
+    # Получаем данные о пользователе
+    user_data = await app.db.get_user(event["user_id"])
+    payment_date = event["payment_date"]
+
+    if user_data:
+        user_id, username, full_name, phone = user_data
+        channel_id = event["channel"]
+        payment_type = f"Подписка на канал {channel_id}" if channel_id is not None else "Пожертвование"
+
+        # Формируем сообщение для администратора
+        lines = [
+            "Новая оплата!",
+            f"Тип оплаты: {payment_type}",
+            f"Сумма: {event['amount'] / 100:.2f} {event['currency']}",
+            f"ID пользователя: {user_id}",
+            f"Имя: {full_name}",
+            f"Username: @{username if username else 'N/A'}",
+            f"Телефон: {phone if phone else 'N/A'}",
+        ]
+        for subscribed_channel_id, is_active, _, end_ts in await app.db.get_user_subscriptions(user_id):
+            lines.append(f"Статус оплаты канал {subscribed_channel_id}: {'Оплачено ✅' if is_active else 'Не оплачено ❌'}")
+            lines.append(f"Дата оплаты канал {subscribed_channel_id}: {payment_date if subscribed_channel_id == channel_id else 'N/A'}")
+            lines.append(f"Дата окончания подписки канал {subscribed_channel_id}: {format_ts(end_ts) or 'N/A'}")
+        admin_message = "\n".join(lines) + "\n"
+
+        # Отправляем сообщение всем администраторам
+        for admin_id in config.ADMIN_IDS:
+            if not direct:
+                app.sender.send_message(admin_id, admin_message)
+                continue
+            try:
+                await app.bot.send_message(admin_id, admin_message)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления администратору {admin_id}: {e}")
+
+# Текст уведомления пользователю о событии планировщика; записывается в outbox
+# в одной транзакции с отметкой о событии (и снятием оплаты для окончания подписки)
+def reminder_text(reminder: Reminder) -> str:
+    channel = reminder.channel
+
+    # Если осталось 3 дня
+    if reminder.action == REMIND_3_DAYS:
+        return f"Ваша подписка на канал {channel} заканчивается через 3 дня. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
+
+    # Если остался 1 день
+    if reminder.action == REMIND_1_DAY:
+        return f"Ваша подписка на канал {channel} заканчивается завтра. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
+
+    # Если подписка истекла
+    if reminder.action == EXPIRE:
+        return f"Ваша подписка на канал {channel} истекла. Пожалуйста, продлите подписку, чтобы снова получить доступ."
+    return None
+
+# Пачка событий планировщика записана в базу
+async def handle_reminders(app: "Application", reminders):
+    expired = [reminder for reminder in reminders if reminder.action == EXPIRE]
+    if not expired:
+        return
+    # Задачи удаления из канала уже в revocations; в сводке для администратора — число
+    # истёкших подписок и пользователи, которых удалить не удалось
+    for reminder in expired:
+        app.digest.add_expired(reminder.user_id, reminder.channel)
+    app.revoker.wake()
+
+# Результат удаления пользователя из канала
+async def handle_revocation(app: "Application", user_id: int, channel: int, status: str, error: str):
+    if status == DONE:
+        logger.info(f"Пользователь {user_id} удалён из канала {channel}")
+        return
+    if error is None:
+        logger.info(f"Удаление пользователя {user_id} из канала {channel} отменено: подписка продлена")
+        return
+    app.digest.add_revoke_failed(user_id, channel, error)
+
+# Роутер с обработчиками; у каждого диспетчера свой, Application передаёт себя в обработчики как app
+def create_router() -> Router:
+    router = Router()
+    router.message.register(send_users_db, Command("get_users_db"))
+    router.message.register(users_page_handler, Command("users"))
+    router.callback_query.register(users_page_callback, F.data.startswith("users_page:"))
+    router.message.register(import_users_handler, Command("import_users"))
+    router.message.register(extend_channel_handler, Command("extend_channel"))
+    router.message.register(broadcast_handler, Command("broadcast"))
+    router.message.register(start_handler, Command("start"))
+    router.message.register(name_handler, UserState.waiting_for_name)
+    router.message.register(contact_handler, UserState.waiting_for_contact, F.contact)
+    router.message.register(manual_phone_handler, UserState.waiting_for_contact)
+    router.callback_query.register(payment_handler, lambda c: c.data.startswith("pay_"))
+    router.callback_query.register(donate_handler, lambda c: c.data == "donate")
+    router.message.register(process_donation_amount, F.text, StateFilter(UserState.waiting_for_donation_amount))
+    router.pre_checkout_query.register(process_pre_checkout_query)
+    router.message.register(successful_payment_handler, F.successful_payment)
+    return router
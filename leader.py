@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElection:
+    """Выбор одного процесса для фоновых задач через строку в таблице locks.
+
+    Лидер продлевает блокировку каждые ttl/3 секунд. Если продлить не
+    удалось (процесс завис или база недоступна дольше ttl), задачи
+    останавливаются, и блокировку через ttl забирает другой процесс.
+    """
+
+    def __init__(self, db, name: str, ttl: int = 30):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+
+    async def run(self, task_factory):
+        # task_factory() возвращает корутину, которая работает, пока процесс — лидер
+        task = None
+        try:
+            while True:
+                try:
+                    acquired = await self.db.acquire_lock(self.name, self.owner, self.ttl)
+                except Exception as e:
+                    logger.error(f"Ошибка продления блокировки {self.name}: {e}")
+                    acquired = False
+
+                if acquired and task is None:
+                    logger.info(f"Процесс {self.owner} выбран лидером ({self.name})")
+                    task = asyncio.create_task(task_factory())
+                elif not acquired and task is not None:
+                    logger.warning(f"Процесс {self.owner} потерял лидерство ({self.name})")
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    task = None
+                elif task is not None and task.done() and not task.cancelled() and task.exception():
+                    logger.error(f"Фоновые задачи лидера завершились с ошибкой: {task.exception()}")
+                    task = asyncio.create_task(task_factory())
+                self.is_leader = task is not None
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            self.is_leader = False
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                try:
+                    await self.db.release_lock(self.name, self.owner)
+                except Exception as e:
+                    logger.error(f"Ошибка освобождения блокировки {self.name}: {e}")
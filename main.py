@@ -1,450 +1,204 @@
+import argparse
 import asyncio
-from aiogram import Bot, Dispatcher, F, types
-from aiogram.types import Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.filters import StateFilter
-import sqlite3
-import config
-import re
-from datetime import datetime, timedelta
+import functools
+import importlib
 import logging
-import threading
-from webhook_server import app  # Импортируем Flask-приложени
-import json
-
-# Инициализация бота, диспетчера и хранилища состояний
-bot = Bot(token=config.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+import signal
+import time
 
-# Подключение к SQLite базе данных
-db = sqlite3.connect("users.db")
-cursor = db.cursor()
-
-# Создаем таблицу, если она не существует
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY,
-    username TEXT,
-    full_name TEXT,
-    phone TEXT,
-    is_paid_channel_1 INTEGER DEFAULT 0,  -- Подписка на канал 1 
-    is_paid_channel_2 INTEGER DEFAULT 0,  -- Подписка на канал 2 
-    payment_date_channel_1 TEXT,  -- Дата оплаты для канала 1
-    payment_date_channel_2 TEXT,  -- Дата оплаты для канала 2
-    subscription_end_date_channel_1 TEXT,  -- Дата окончания подписки для канала 1
-    subscription_end_date_channel_2 TEXT  -- Дата окончания подписки для канала 2
-)
-""")
-db.commit()
+import config
+from application import Application
 
 logger = logging.getLogger(__name__)  # Создаем объект logger
 
-# Команда /get_users_db
-@dp.message(Command("get_users_db"))
-async def send_users_db(message: Message):
-    # Проверяем, есть ли пользователь в списке администраторов
-    if message.from_user.id not in config.ADMIN_IDS:
-        await message.answer("У вас нет прав для выполнения этой команды.")
-        return
-
-    # Получаем данные из базы данных
-    cursor.execute("SELECT id, username, full_name, phone, is_paid_channel_1, is_paid_channel_2, payment_date_channel_1, payment_date_channel_2, subscription_end_date_channel_1, subscription_end_date_channel_2 FROM users")
-    users = cursor.fetchall()
-
-    if not users:
-        await message.answer("В базе данных нет пользователей.")
-        return
-
-    # Формируем сообщение с данными пользователей
-    users_info = []
-    for user in users:
-        user_id, username, full_name, phone, is_paid_channel_1, is_paid_channel_2, payment_date_channel_1, payment_date_channel_2, subscription_end_date_channel_1, subscription_end_date_channel_2 = user
-        paid_status_channel_1 = "Оплачено ✅" if is_paid_channel_1 else "Не оплачено ❌"
-        paid_status_channel_2 = "Оплачено ✅" if is_paid_channel_2 else "Не оплачено ❌"
-        user_info = (
-            f"ID: {user_id}\n"
-            f"Имя: {full_name}\n"
-            f"Username: @{username if username else 'N/A'}\n"
-            f"Телефон: {phone if phone else 'N/A'}\n"
-            f"Статус оплаты канал 1 (Тренировки с Сэнсэем): {paid_status_channel_1}\n"
-            f"Дата оплаты канал 1: {payment_date_channel_1 if payment_date_channel_1 else 'N/A'}\n"
-            f"Дата окончания подписки канал 1: {subscription_end_date_channel_1 if subscription_end_date_channel_1 else 'N/A'}\n"
-            f"Статус оплаты канал 2 (Метод ОСС | обучение по исправлению осанки): {paid_status_channel_2}\n"
-            f"Дата оплаты канал 2: {payment_date_channel_2 if payment_date_channel_2 else 'N/A'}\n"
-            f"Дата окончания подписки канал 2: {subscription_end_date_channel_2 if subscription_end_date_channel_2 else 'N/A'}\n"
-            "-----------------------------"
-        )
-        users_info.append(user_info)
-
-    # Разбиваем сообщение на части, если оно слишком длинное
-    message_text = "\n".join(users_info)
-    for part in [message_text[i:i + 4096] for i in range(0, len(message_text), 4096)]:
-        await message.answer(part)
-
-# Определяем состояния
-class UserState(StatesGroup):
-    waiting_for_name = State()
-    waiting_for_contact = State()
-    waiting_for_donation_amount = State()
-
-# Кнопки для ввода номера телефона
-contact_button = KeyboardButton(text="Поделиться номером телефона", request_contact=True)
-contact_keyboard = ReplyKeyboardMarkup(keyboard=[[contact_button]], resize_keyboard=True)
-
-# Команда /start
-@dp.message(Command("start"))
-async def start_handler(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    await message.answer("Привет! Давай начнем. Как тебя зовут?")
-    await state.set_state(UserState.waiting_for_name)
-
-# Обработка имени пользователя
-@dp.message(UserState.waiting_for_name)
-async def name_handler(message: Message, state: FSMContext):
-    full_name = message.text
-    user_id = message.from_user.id
-    username = message.from_user.username
+# Модули бота в порядке их загрузки при запуске (для --profile-startup)
+STARTUP_MODULES = (
+    "aiogram", "metrics", "database", "fsm_storage", "sender", "outbox", "scheduler", "revocation",
+    "leader", "digest", "update_processor", "handlers", "webhook_server",
+)
+STARTUP_COMPONENTS = (
+    "db", "bot", "storage", "dp", "sender", "outbox", "scheduler", "revoker",
+    "leader", "digest", "update_processor", "webhook_app",
+)
 
-    # Сохраняем имя в базу
-    cursor.execute("INSERT OR IGNORE INTO users (id, username, full_name) VALUES (?, ?, ?)", 
-                   (user_id, username, full_name))
-    db.commit()
+# Фабрика приложения: ничего не открывает, компоненты создаются при первом обращении
+def create_application(bot=None, db_path: str = "users.db") -> Application:
+    return Application(bot=bot, db_path=db_path)
 
-    await message.answer(
-        "Спасибо! Теперь поделись своим номером телефона с помощью кнопки ниже или в формате +79991234567.",
-        reply_markup=contact_keyboard
+# getMe нужен long polling; запрашиваем его заранее, параллельно с открытием базы.
+# Ошибка не останавливает запуск: bot.me() повторит запрос при следующем обращении
+async def prefetch_me(application: Application):
+    try:
+        await application.bot.me()
+    except Exception as e:
+        logger.warning(f"Не удалось получить данные бота при запуске: {e}")
+
+# База и сессия бота нужны в любом режиме
+def add_base_hooks(application: Application):
+    application.add_hook("db", application.db.open, application.db.close)
+    application.add_hook("bot", functools.partial(prefetch_me, application), application.bot.session.close)
+
+# Очередь отправки, сводка и хранилище FSM процесса, который обрабатывает апдейты
+def add_bot_hooks(application: Application):
+    add_base_hooks(application)
+    application.add_hook("sender", application.sender.start, application.sender.stop, stage=1)
+    application.add_hook("digest", application.digest.start, application.digest.close, stage=1)
+    application.add_hook("storage", stop=application.dp.storage.close, stage=1)
+
+# Обработка апдейтов из очереди (webhook или процесс-воркер)
+async def start_updates(application: Application):
+    application.update_processor.start()
+    await application.dp.emit_startup(bot=application.bot)
+
+async def stop_updates(application: Application):
+    # Сначала дообрабатываем принятые апдейты, потом закрываем всё остальное
+    await application.update_processor.drain()
+    await application.dp.emit_shutdown(bot=application.bot)
+
+def add_updates_hook(application: Application, stage: int):
+    application.add_hook(
+        "updates", functools.partial(start_updates, application), functools.partial(stop_updates, application), stage
     )
-    await state.set_state(UserState.waiting_for_contact)
 
-# Обработка номера телефона через кнопку "Поделиться номером телефона"
-@dp.message(UserState.waiting_for_contact, F.contact)
-async def contact_handler(message: Message, state: FSMContext):
-    phone = message.contact.phone_number
-    user_id = message.from_user.id
+# Планировщик и удаление из каналов работают только в процессе-лидере
+def add_leader_hook(application: Application, stage: int):
+    application.add_task("leader", lambda: application.leader.run(application.run_leader_tasks), stage)
 
-    # Сохраняем номер телефона в базу
-    cursor.execute("UPDATE users SET phone = ? WHERE id = ?", (phone, user_id))
-    db.commit()
-
-    await send_payment_prompt(message, state)
-
-# Обработка номера телефона, введенного вручную
-@dp.message(UserState.waiting_for_contact)
-async def manual_phone_handler(message: Message, state: FSMContext):
-    phone = message.text.strip()
-
-    # Проверяем, является ли текст корректным номером телефона
-    if not re.fullmatch(r"^\+?\d{10,15}$", phone):  # Номер телефона должен содержать от 10 до 15 цифр
-        await message.answer(
-            "Пожалуйста, введите корректный номер телефона в международном формате (например, +79991234567)."
-        )
-        return
-
-    user_id = message.from_user.id
-
-    # Сохраняем номер телефона в базу
-    cursor.execute("UPDATE users SET phone = ? WHERE id = ?", (phone, user_id))
-    db.commit()
-
-    await send_payment_prompt(message, state)
-
-# Функция отправки сообщения с предложением оплатить подписку
-async def send_payment_prompt(message: Message, state: FSMContext):
-    # Кнопки для выбора типа платежа
-    pay_button_1 = InlineKeyboardButton(text="Оплатить канал 1 [300 руб]", callback_data="pay_channel_1")   
-    pay_button_2 = InlineKeyboardButton(text="Оплатить канал 2 [3000 руб]", callback_data="pay_channel_2")
-    donate_button = InlineKeyboardButton(text="Сделать пожертвование", callback_data="donate")
-    pay_keyboard = InlineKeyboardMarkup(inline_keyboard=[[pay_button_1], [pay_button_2], [donate_button]])
-    
-    await message.answer(
-        "Спасибо! Выберите тип платежа:",
-        reply_markup=pay_keyboard
+async def set_webhook(application: Application):
+    await application.bot.set_webhook(
+        config.TELEGRAM_WEBHOOK_URL.rstrip("/") + config.TELEGRAM_WEBHOOK_PATH,
+        secret_token=config.TELEGRAM_WEBHOOK_SECRET or None,
+        allowed_updates=application.dp.resolve_used_update_types(),
     )
-    await state.clear()  # Сбрасываем состояние
 
-# Обработка выбора типа платежа
-@dp.callback_query(lambda c: c.data.startswith("pay_"))
-async def payment_handler(callback: CallbackQuery):
-    if callback.data == "pay_channel_1":
-        prices = [types.LabeledPrice(label="Подписка на канал 1", amount=30000)]  # 300 рублей
-        payload = "subscription_channel_1"
-    elif callback.data == "pay_channel_2":
-        prices = [types.LabeledPrice(label="Подписка на канал 2)", amount=300000)]  # 3000 рублей
-        payload = "subscription_channel_2"
-    
-    await bot.send_invoice(
-        chat_id=callback.from_user.id,
-        title="Подписка на канал",
-        description="Оплата доступа к закрытому каналу",
-        provider_token=config.PAYMENT_PROVIDER_TOKEN,
-        currency="RUB",
-        prices=prices,
-        payload=payload,
-    )
-    await callback.answer()  # Закрываем всплывающее уведомление
+# Ожидание сигнала остановки (Ctrl+C, SIGTERM)
+async def wait_for_shutdown():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass  # Windows: остановка через KeyboardInterrupt
+    await stop_event.wait()
 
-# Обработка пожертвования
-@dp.callback_query(lambda c: c.data == "donate")
-async def donate_handler(callback: CallbackQuery, state: FSMContext):
-    await callback.message.answer("Введите сумму пожертвования в рублях:")
-    await state.set_state(UserState.waiting_for_donation_amount)
-    await callback.answer()
+# Запуск бота
+async def main(application: Application = None):
+    if application is None:
+        application = create_application()
+    add_bot_hooks(application)
+    webhook_mode = bool(config.TELEGRAM_WEBHOOK_URL)
+    # Webhook-сервер ЮКассы (и Telegram в режиме webhook) работает в том же event loop, что и бот
+    application.add_webhook_server(
+        application.update_processor if webhook_mode else None, stage=2, sender=application.sender
+    )
+    add_leader_hook(application, stage=2)
+    if webhook_mode:
+        add_updates_hook(application, stage=3)
 
-# Обработка ввода суммы пожертвования
-@dp.message(F.text, StateFilter(UserState.waiting_for_donation_amount))
-async def process_donation_amount(message: Message, state: FSMContext):
+    await application.start()
     try:
-        amount_rub = float(message.text)  # Преобразуем ввод в число
-        if amount_rub < 60:  # Минимальная сумма — 60 рублей
-            await message.answer("Минимальная сумма пожертвования — 60 рублей.")
-            return
-        amount = int(amount_rub * 100)  # Переводим рубли в копейки
-
-        prices = [types.LabeledPrice(label="Пожертвование", amount=amount)]
-        
-        await bot.send_invoice(
-            chat_id=message.from_user.id,
-            title="Пожертвование",
-            description="Спасибо за вашу поддержку!",
-            provider_token=config.PAYMENT_PROVIDER_TOKEN,
-            currency="RUB",
-            prices=prices,
-            payload="donation"
-        )
-        await state.clear()
-    except ValueError:
-        await message.answer("Пожалуйста, введите корректную сумму.")
-
-@dp.pre_checkout_query()
-async def process_pre_checkout_query(pre_checkout_query: types.PreCheckoutQuery):
-    await bot.answer_pre_checkout_query(pre_checkout_query.id, ok=True)
-
-# Обработка успешной оплаты
-@dp.message(F.successful_payment)
-async def successful_payment_handler(message: Message):
-    logger.info("Успешный платеж получен!")
-    user_id = message.from_user.id
-    payload = message.successful_payment.invoice_payload
-
-    # Логируем информацию о платеже
-    logger.info(f"Пользователь {user_id} оплатил: {payload}")
-
-    # Получаем текущую дату
-    payment_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    if payload == "subscription_channel_1":
-        # Получаем текущую дату окончания подписки для канала 1
-        cursor.execute("SELECT subscription_end_date_channel_1 FROM users WHERE id = ?", (user_id,))
-        result = cursor.fetchone()
-        current_subscription_end = result[0] if result else None
-
-        # Если у пользователя есть активная подписка, продлеваем её
-        if current_subscription_end and datetime.strptime(current_subscription_end, "%Y-%m-%d %H:%M:%S") > datetime.now():
-            new_subscription_end = (datetime.strptime(current_subscription_end, "%Y-%m-%d %H:%M:%S") + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            new_subscription_end = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
-
-        # Обновляем статус оплаты, даты и информацию о подписке для канала 1
-        cursor.execute(
-            "UPDATE users SET is_paid_channel_1 = 1, payment_date_channel_1 = ?, subscription_end_date_channel_1 = ? WHERE id = ?",
-            (payment_date, new_subscription_end, user_id)
-        )
-        db.commit()
-        logger.info(f"Пользователь {user_id} подписан на Канал 1 (Тренировки с Сэнсэем)")
-        await message.answer(f"Ваша подписка на канал 1 продлена до {new_subscription_end}.")
-        invite_link = 'https://t.me/...'  # Замените на реальную ссылку
-        await message.answer(
-            "Оплата прошла успешно! Добро пожаловать в канал 1. Перейди по ссылке, чтобы присоединиться:",   
-            reply_markup=types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [types.InlineKeyboardButton(text="Присоединиться к канал 1", url=invite_link)]
-                ]
-            )
-        )
-    elif payload == "subscription_channel_2":
-        # Получаем текущую дату окончания подписки для канала 2
-        cursor.execute("SELECT subscription_end_date_channel_2 FROM users WHERE id = ?", (user_id,))
-        result = cursor.fetchone()
-        current_subscription_end = result[0] if result else None
-
-        # Если у пользователя есть активная подписка, продлеваем её
-        if current_subscription_end and datetime.strptime(current_subscription_end, "%Y-%m-%d %H:%M:%S") > datetime.now():
-            new_subscription_end = (datetime.strptime(current_subscription_end, "%Y-%m-%d %H:%M:%S") + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
+        if not webhook_mode:
+            # Сессию бота закрываем сами: после остановки ещё отправляется очередь сообщений
+            await application.dp.start_polling(application.bot, close_bot_session=False)
         else:
-            new_subscription_end = (datetime.now() + timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
-
-        # Обновляем статус оплаты, даты и информацию о подписке для канала 2
-        cursor.execute(
-            "UPDATE users SET is_paid_channel_2 = 1, payment_date_channel_2 = ?, subscription_end_date_channel_2 = ? WHERE id = ?",
-            (payment_date, new_subscription_end, user_id)
-        )
-        db.commit()
-        logger.info(f"Пользователь {user_id} подписан на Канал 2")
-        await message.answer(f"Ваша подписка на канал 2) продлена до {new_subscription_end}.")
-        invite_link = 'https://t.me/...'  # Замените на реальную ссылку
-        await message.answer(
-            "Оплата прошла успешно! Добро пожаловать в канал 2). Перейди по ссылке, чтобы присоединиться:",
-            reply_markup=types.InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [types.InlineKeyboardButton(text="Присоединиться к канал 2", url=invite_link)]
-                ]
-            )
-        )
-    elif payload == "donation":
-        logger.info(f"Пользователь {user_id} сделал пожертвование")
-        await message.answer("Спасибо за ваше пожертвование! Ваша поддержка очень важна для нас.")
-
-    # Отправляем уведомление администратору
-    await notify_admin(user_id, payload, payment_date)
-
-# Функция для отправки уведомления администратору
-async def notify_admin(user_id: int, payload: str, payment_date: str):
-    # Получаем данные о пользователе
-    cursor.execute("SELECT id, username, full_name, phone, is_paid_channel_1, is_paid_channel_2, subscription_end_date_channel_1, subscription_end_date_channel_2 FROM users WHERE id = ?", (user_id,))
-    user_data = cursor.fetchone()
-
-    if user_data:
-        user_id, username, full_name, phone, is_paid_channel_1, is_paid_channel_2, subscription_end_date_channel_1, subscription_end_date_channel_2 = user_data
-        paid_status_channel_1 = "Оплачено ✅" if is_paid_channel_1 else "Не оплачено ❌"
-        paid_status_channel_2 = "Оплачено ✅" if is_paid_channel_2 else "Не оплачено ❌"
-        payment_type = "Подписка на канал 1" if payload == "subscription_channel_1" else "Подписка на канал 2" if payload == "subscription_channel_2" else "Пожертвование"
-
-        # Формируем сообщение для администратора
-        admin_message = (
-            f"Новая оплата!\n"
-            f"Тип оплаты: {payment_type}\n"
-            f"ID пользователя: {user_id}\n"
-            f"Имя: {full_name}\n"
-            f"Username: @{username if username else 'N/A'}\n"
-            f"Телефон: {phone if phone else 'N/A'}\n"
-            f"Статус оплаты канал 1: {paid_status_channel_1}\n"
-            f"Дата оплаты канал 1: {payment_date if payload == 'subscription_channel_1' else 'N/A'}\n"
-            f"Дата окончания подписки канал 1: {subscription_end_date_channel_1 if subscription_end_date_channel_1 else 'N/A'}\n"
-            f"Статус оплаты канал 2: {paid_status_channel_2}\n"
-            f"Дата оплаты канал 2: {payment_date if payload == 'subscription_channel_2' else 'N/A'}\n"
-            f"Дата окончания подписки канал 2: {subscription_end_date_channel_2 if subscription_end_date_channel_2 else 'N/A'}\n"
-        )
-
-        # Отправляем сообщение всем администраторам
-        for admin_id in config.ADMIN_IDS:
-            await bot.send_message(admin_id, admin_message)
-
-async def manage_subscriptions():
-    while True:
-        now = datetime.now()
-        
-        # Проверяем подписки на канал 1
-        cursor.execute("SELECT id, subscription_end_date_channel_1, full_name, username FROM users WHERE is_paid_channel_1 = 1")
-        users_channel_1 = cursor.fetchall()
-
-        # Проверяем подписки на канал 2
-        cursor.execute("SELECT id, subscription_end_date_channel_2, full_name, username FROM users WHERE is_paid_channel_2 = 1")
-        users_channel_2 = cursor.fetchall()
-
-        # Обработка подписок на канал 1
-        for user in users_channel_1:
-            user_id, subscription_end_date_str, full_name, username = user
-            subscription_end_date = datetime.strptime(subscription_end_date_str, "%Y-%m-%d %H:%M:%S")
-            delta = subscription_end_date - now
-
-            try:
-                # Если осталось 3 дня
-                if timedelta(days=3) >= delta > timedelta(days=2):
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 1 заканчивается через 3 дня. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
-                    )
-
-                # Если остался 1 день
-                elif timedelta(days=1) >= delta > timedelta(hours=0):
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 1 заканчивается завтра. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
-                    )
-
-                # Если подписка истекла
-                elif delta <= timedelta(hours=0):
-                    # Обновляем статус подписки на канал 1
-                    cursor.execute("UPDATE users SET is_paid_channel_1 = 0 WHERE id = ?", (user_id,))
-                    db.commit()
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 1 истекла. Пожалуйста, продлите подписку, чтобы снова получить доступ."
-                    )
-
-                    # Уведомляем администратора
-                    for admin_id in config.ADMIN_IDS:
-                        await bot.send_message(
-                            admin_id,
-                            f"Подписка пользователя {full_name} (@{username if username else 'N/A'}) на канал 1 истекла. Необходимо удалить пользователя из канала."
-                        )
-
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-
-        # Обработка подписок на канал 2
-        for user in users_channel_2:
-            user_id, subscription_end_date_str, full_name, username = user
-            subscription_end_date = datetime.strptime(subscription_end_date_str, "%Y-%m-%d %H:%M:%S")
-            delta = subscription_end_date - now
-
-            try:
-                # Если осталось 3 дня
-                if timedelta(days=3) >= delta > timedelta(days=2):
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 2 заканчивается через 3 дня. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
-                    )
-
-                # Если остался 1 день
-                elif timedelta(days=1) >= delta > timedelta(hours=0):
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 2 заканчивается завтра. Пожалуйста, продлите подписку, чтобы продолжить пользоваться услугами."
-                    )
-
-                # Если подписка истекла
-                elif delta <= timedelta(hours=0):
-                    # Обновляем статус подписки на канал 2
-                    cursor.execute("UPDATE users SET is_paid_channel_2 = 0 WHERE id = ?", (user_id,))
-                    db.commit()
-                    await bot.send_message(
-                        user_id,
-                        "Ваша подписка на канал 2 истекла. Пожалуйста, продлите подписку, чтобы снова получить доступ."
-                    )
-
-                    # Уведомляем администратора
-                    for admin_id in config.ADMIN_IDS:
-                        await bot.send_message(
-                            admin_id,
-                            f"Подписка пользователя {full_name} (@{username if username else 'N/A'}) на канал 2 истекла. Необходимо удалить пользователя из канала."
-                        )
-
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
-
-        # Ждем до полуночи следующего дня
-        now = datetime.now()
-        next_midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
-        await asyncio.sleep((next_midnight - now).total_seconds())
-
-# Запуск веб-сервера в отдельном потоке
-def run_webhook_server():
-    app.run(port=5000, ssl_context='adhoc')
-
-# Запуск бота
-async def main():
-    # Запускаем веб-сервер в отдельном потоке
-    webhook_thread = threading.Thread(target=run_webhook_server)
-    webhook_thread.daemon = True  # Поток завершится при завершении основного потока
-    webhook_thread.start()
-
-    # Запускаем проверку подписок в фоновом режиме
-    asyncio.create_task(manage_subscriptions())
-    await dp.start_polling(bot)
+            await set_webhook(application)
+            await wait_for_shutdown()
+    finally:
+        await application.stop()
+        cache = application.db.cache
+        logger.info(f"Кэш пользователей: попаданий {cache.hits}, промахов {cache.misses}")
+
+# Процесс-воркер при WORKER_PROCESSES > 1: обрабатывает апдейты своей доли пользователей
+async def run_worker(shard_queue, shards: int):
+    from shards import consume
+
+    application = create_application()
+    add_bot_hooks(application)
+    # Общий лимит Telegram делится между процессами
+    application.sender.global_bucket.rate = config.SEND_RATE_GLOBAL / shards
+    add_updates_hook(application, stage=2)
+    add_leader_hook(application, stage=2)
+
+    await application.start()
+    try:
+        await consume(shard_queue, application.update_processor)
+    finally:
+        await application.stop()
+
+def worker_process(shard_queue, shards: int):
+    # Остановкой воркеров управляет супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(shard_queue, shards))
+
+# Супервизор: принимает апдейты и платежи ЮКассы, раздаёт апдейты воркерам по id пользователя
+async def supervise(shards: int, application: Application = None):
+    import handlers
+    from shards import ShardRouter
+
+    if application is None:
+        application = create_application()
+    router = ShardRouter(worker_process, shards)
+    webhook_mode = bool(config.TELEGRAM_WEBHOOK_URL)
+    add_base_hooks(application)
+    application.add_hook("workers", router.start, router.drain, stage=1)
+    # Оплаты ЮКассы из супервизора попадают в сводку через admin_events, отправляет её воркер-лидер.
+    # Очереди отправки в супервизоре нет, поэтому срочные уведомления о крупных оплатах идут через бота
+    application.digest.is_sender = lambda: False
+    application.digest.on_alert = functools.partial(handlers.notify_admin, application, direct=True)
+    application.add_hook("digest", application.digest.start, application.digest.close, stage=1)
+    application.add_webhook_server(router if webhook_mode else None, stage=2)
+    if not webhook_mode:
+        allowed_updates = application.dp.resolve_used_update_types()
+        application.add_task("polling", lambda: router.poll(application.bot, allowed_updates=allowed_updates), stage=3)
+
+    await application.start()
+    try:
+        if webhook_mode:
+            await set_webhook(application)
+        await wait_for_shutdown()
+    finally:
+        await application.stop()
+
+# python main.py --profile-startup: время импорта и создания каждого компонента
+def profile_startup(db_path: str):
+    rows = []
+    for name in STARTUP_MODULES:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        rows.append((f"import {name}", time.perf_counter() - started))
+
+    application = create_application(db_path=db_path)
+    for name in STARTUP_COMPONENTS:
+        getattr(application, name)
+    rows.extend((f"create {name}", application.timings[name]) for name in STARTUP_COMPONENTS)
+
+    # Из хуков запуска без сети выполняется только открытие базы (с миграциями)
+    async def open_database():
+        application.add_hook("db", application.db.open, application.db.close)
+        await application.start()
+        await application.stop()
+
+    asyncio.run(open_database())
+    rows.append(("open db", application.timings["start:db"]))
+    rows.append(("close db", application.timings["stop:db"]))
+
+    for name, seconds in rows:
+        print(f"{name:<26}{seconds * 1000:>10.1f} мс")
+    print(f"{'итого':<26}{sum(seconds for _, seconds in rows) * 1000:>10.1f} мс")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="показать время импорта и инициализации компонентов и выйти")
+    parser.add_argument("--db", default="users.db", help="база для --profile-startup")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.profile_startup:
+        profile_startup(args.db)
+    elif config.WORKER_PROCESSES > 1:
+        asyncio.run(supervise(config.WORKER_PROCESSES))
+    else:
+        asyncio.run(main())
\ No newline at end of file
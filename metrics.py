@@ -0,0 +1,172 @@
+import bisect
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict
+
+if TYPE_CHECKING:
+    from aiogram import Dispatcher
+    from aiogram.types import TelegramObject, Update
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels_text(labelnames, values, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        # Повторная регистрация (например, очередь отправки нового Application) заменяет прежнюю
+        self._metrics = [existing for existing in self._metrics if existing.name != metric.name]
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        # Текстовый формат Prometheus (text/plain; version=0.0.4)
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, *labels, amount: float = 1):
+        # Вызывается только из event loop, блокировка не нужна
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels_text(self.labelnames, labels)} {value}"
+
+
+class CallbackMetric:
+    """Значение, которое уже считается где-то ещё (счётчики OutboundSender, кэша и т.п.)."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], type: str = "gauge",
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.type = type
+        registry.register(self)
+
+    def samples(self):
+        yield f"{self.name} {self.callback()}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._values = {}
+        registry.register(self)
+
+    def observe(self, value: float, *labels):
+        # Как и Counter.inc, вызывается только из event loop
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels_text(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels_text(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels_text(self.labelnames, labels)} {count}"
+
+
+# --- Метрики бота ---
+
+UPDATES = Counter("bot_updates_total", "Входящие апдейты по типу", ("type",))
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Полное время обработки апдейта", ("type",))
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ("handler",))
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Время запроса к базе с учётом ожидания пула", ("query",))
+SEND_SECONDS = Histogram("sender_request_seconds", "Время запроса к Bot API из очереди отправки", ("method",))
+WEBHOOK_SECONDS = Histogram("webhook_request_seconds", "Время обработки HTTP-запроса", ("path", "status"))
+YOOKASSA_EVENTS = Counter("yookassa_webhook_events_total", "Уведомления ЮКассы по результату приёма", ("result",))
+
+
+def register_sender(sender, registry: Registry = REGISTRY):
+    CallbackMetric("sender_sent_total", "Отправлено сообщений", lambda: sender.sent, "counter", registry)
+    CallbackMetric("sender_retried_429_total", "Повторов после 429", lambda: sender.retried_429, "counter", registry)
+    CallbackMetric("sender_dead_total", "Сообщений в dead_letters", lambda: sender.dead, "counter", registry)
+    CallbackMetric("sender_queue_size", "Сообщений в очереди", lambda: sender._queue.qsize(), "gauge", registry)
+
+
+def register_user_cache(cache, registry: Registry = REGISTRY):
+    CallbackMetric("user_cache_hits_total", "Попадания в кэш пользователей", lambda: cache.hits, "counter", registry)
+    CallbackMetric("user_cache_misses_total", "Промахи кэша пользователей", lambda: cache.misses, "counter", registry)
+    CallbackMetric("user_cache_size", "Записей в кэше пользователей", lambda: len(cache), "gauge", registry)
+
+
+# Middleware — обычные вызываемые объекты, а не наследники aiogram.BaseMiddleware:
+# модуль импортирует и database, которой aiogram не нужен
+
+class UpdateMetricsMiddleware:
+    # Внешний middleware апдейтов: количество и полное время по типу апдейта
+    async def __call__(self, handler: Callable[["TelegramObject", Dict[str, Any]], Awaitable[Any]],
+                       event: "Update", data: Dict[str, Any]) -> Any:
+        update_type = event.event_type
+        UPDATES.inc(update_type)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, update_type)
+
+
+class HandlerMetricsMiddleware:
+    # Внутренний middleware: вызывается только для сработавшего обработчика
+    async def __call__(self, handler: Callable[["TelegramObject", Dict[str, Any]], Awaitable[Any]],
+                       event: "TelegramObject", data: Dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def setup_dispatcher(dp: "Dispatcher"):
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    middleware = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(middleware)
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationOutbox:
+    """Доставка уведомлений из таблицы outbox.
+
+    Уведомление попадает в outbox в той же транзакции, что и изменение,
+    о котором оно сообщает, поэтому падение процесса между изменением и
+    отправкой его не теряет. Воркер забирает неотправленные пачками,
+    отправляет через OutboundSender и отмечает отправленные сразу после
+    отправки. Повторно после падения может уйти только сообщение, которое
+    Telegram принял, а отметка о нём не успела записаться. При остановке уже
+    переданные в очередь отправки сообщения дожидаются отправки и тоже
+    отмечаются.
+    """
+
+    def __init__(self, db, sender, batch_size: int = 100, stop_timeout: float = 10):
+        self.db = db
+        self.sender = sender
+        self.batch_size = batch_size
+        self.stop_timeout = stop_timeout
+        self._wakeup = asyncio.Event()
+        self.sent = 0
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _mark_done(self, pending):
+        # Результат None (сообщение ушло в dead_letters) тоже завершает доставку: оно сохранено там
+        done = [future for future in pending if future.done()]
+        if not done:
+            return
+        await self.db.mark_notifications_sent([pending[future] for future in done])
+        for future in done:
+            del pending[future]
+        self.sent += len(done)
+
+    async def _deliver(self, batch):
+        # future OutboundSender -> id записи в outbox
+        pending = {self.sender.send_message(chat_id, text): notification_id for notification_id, chat_id, text in batch}
+        try:
+            while pending:
+                # Отмечаем сразу после отправки: всё, что успело завершиться за время
+                # предыдущей записи, уходит одной транзакцией
+                await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                await self._mark_done(pending)
+        finally:
+            if pending:
+                # Остановка: переданные в очередь отправки сообщения всё равно уйдут, дожидаемся и отмечаем их
+                await asyncio.wait(list(pending), timeout=self.stop_timeout)
+                await self._mark_done(pending)
+
+    async def run_batch(self) -> int:
+        batch = await self.db.get_pending_notifications(self.batch_size)
+        if batch:
+            await self._deliver(batch)
+        return len(batch)
+
+    async def run(self):
+        while True:
+            # Сбрасываем до чтения: уведомление, записанное во время чтения, разбудит цикл снова
+            self._wakeup.clear()
+            try:
+                if await self.run_batch():
+                    continue
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомлений из outbox: {e}")
+            # asyncio.wait, а не wait_for: см. AdminDigest._loop
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=60)
+            finally:
+                waiter.cancel()
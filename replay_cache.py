@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+
+
+class ReplayCache:
+    """Недавно принятые уведомления для отсечения повторов.
+
+    Ключ хранится ttl секунд; записи лежат в порядке добавления, поэтому
+    устаревшие снимаются с начала, и проверка, и добавление — O(1) в
+    среднем. При переполнении вытесняются самые старые. Повтор старше
+    окна кэш не заметит — его отсекает уникальный ключ платежа в базе.
+    """
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # ключ -> истекает в
+        self._entries = OrderedDict()
+        self.replays = 0
+
+    def _expire(self, now: float):
+        entries = self._entries
+        while entries:
+            key, expires = next(iter(entries.items()))
+            if expires > now:
+                break
+            del entries[key]
+
+    def seen(self, key) -> bool:
+        self._expire(time.monotonic())
+        if key in self._entries:
+            self.replays += 1
+            return True
+        return False
+
+    def add(self, key):
+        self._entries.pop(key, None)
+        self._entries[key] = time.monotonic() + self.ttl
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class MemberRevoker:
+    """Удаление пользователей с истёкшей подпиской из каналов.
+
+    Задачи хранятся в таблице revocations, поэтому переживают перезапуск.
+    Воркер забирает их пачками и выполняет ban + unban (кик без вечной
+    блокировки) с ограничением параллельности, повторяя запрос после 429
+    и сетевых ошибок. Результат по каждому пользователю пишется в базу.
+    """
+
+    def __init__(self, bot: Bot, db, concurrency: int = 5, batch_size: int = 50, max_attempts: int = 5,
+                 on_result=None):
+        self.bot = bot
+        self.db = db
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Вызывается с (user_id, channel_id, status, error) после обработки
+        self.on_result = on_result
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self.processed = 0
+        self.retried_429 = 0
+
+    def wake(self):
+        # Задачи записываются в revocations вместе с окончанием подписки
+        self._wakeup.set()
+
+    async def _kick(self, chat_id: int, user_id: int):
+        # Бан сразу снимается: пользователь удалён, но после оплаты сможет вернуться
+        await self.bot.ban_chat_member(chat_id, user_id)
+        await self.bot.unban_chat_member(chat_id, user_id, only_if_banned=True)
+
+    async def _process(self, user_id: int, channel_id: int, end_ts: int, chat_id: int, attempts: int,
+                       renewed: int):
+        if renewed:
+            # Пользователь оплатил снова, пока задача ждала очереди, — удалять не нужно
+            return user_id, channel_id, end_ts, SKIPPED, attempts, None
+        if chat_id is None:
+            # Для канала не указан chat_id — удалить можно только вручную
+            return user_id, channel_id, end_ts, SKIPPED, attempts, "chat_id канала не задан"
+
+        error = None
+        async with self._semaphore:
+            while attempts < self.max_attempts:
+                attempts += 1
+                try:
+                    await self._kick(chat_id, user_id)
+                    return user_id, channel_id, end_ts, DONE, attempts, None
+                except TelegramRetryAfter as e:
+                    self.retried_429 += 1
+                    error = str(e)
+                    await asyncio.sleep(e.retry_after)
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    error = str(e)
+                    await asyncio.sleep(min(2 ** attempts, 60))
+                except Exception as e:
+                    # Нет прав администратора, пользователь не найден и т.п. — повтор не поможет
+                    error = str(e)
+                    break
+        logger.error(f"Не удалось удалить пользователя {user_id} из канала {channel_id}: {error}")
+        return user_id, channel_id, end_ts, FAILED, attempts, error
+
+    async def run_batch(self) -> int:
+        pending = await self.db.get_pending_revocations(self.batch_size)
+        if not pending:
+            return 0
+        results = await asyncio.gather(*(self._process(*row) for row in pending))
+        # Результаты всей пачки — одной транзакцией
+        await self.db.save_revocation_results(results)
+        self.processed += len(results)
+        if self.on_result is not None:
+            for user_id, channel_id, _, status, _, error in results:
+                await self.on_result(user_id, channel_id, status, error)
+        return len(results)
+
+    async def run(self):
+        while True:
+            try:
+                if await self.run_batch():
+                    continue
+            except Exception as e:
+                logger.error(f"Ошибка обработки очереди удалений: {e}")
+            self._wakeup.clear()
+            # asyncio.wait, а не wait_for: см. AdminDigest._loop
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=60)
+            finally:
+                waiter.cancel()
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import NamedTuple
+
+from database import SUBSCRIPTIONS_GENERATION
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+
+REMIND_3_DAYS = "remind_3_days"
+REMIND_1_DAY = "remind_1_day"
+EXPIRE = "expire"
+
+# За сколько секунд до окончания подписки выполняется действие и до какого
+# остатка времени оно ещё актуально (напоминание «за 3 дня» бессмысленно,
+# если до конца подписки меньше двух дней)
+ACTIONS = (
+    (REMIND_3_DAYS, 3 * DAY, 2 * DAY),
+    (REMIND_1_DAY, DAY, 0),
+    (EXPIRE, 0, None),
+)
+
+
+class Reminder(NamedTuple):
+    due_ts: int
+    user_id: int
+    channel: int
+    action: str
+    end_ts: int
+
+
+class ReminderScheduler:
+    """Планировщик напоминаний и окончаний подписок.
+
+    В памяти держится min-heap событий только на ближайшее окно (horizon),
+    события подгружаются из базы по индексу порциями. Наступившие события
+    обрабатываются пачками до chunk_size: отметка в sent_reminders, снятие
+    оплаты, очередь удаления из каналов и уведомления в outbox записываются
+    одной транзакцией на пачку. После падения процесса пачка либо записана
+    целиком (уведомления дошлёт outbox), либо не записана и будет выполнена
+    заново, поэтому уведомления не теряются и не дублируются. Ошибка базы
+    не останавливает цикл: он повторяет шаг с нарастающей паузой до max_delay.
+
+    Массовые операции (импорт, продление канала) могут идти в другом
+    процессе, поэтому о них планировщик узнаёт из базы: раз в poll_interval
+    сверяет счётчик SUBSCRIPTIONS_GENERATION и при изменении собирает
+    очередь заново.
+    """
+
+    def __init__(self, db, render, on_applied=None, outbox=None, horizon: int = 6 * 60 * 60,
+                 chunk_size: int = 500, max_delay: float = 60, poll_interval: float = 30):
+        self.db = db
+        # render(reminder) — текст уведомления пользователю или None
+        self.render = render
+        # Вызывается со списком выполненных событий после записи пачки
+        self.on_applied = on_applied
+        self.outbox = outbox
+        self.horizon = horizon
+        self.chunk_size = chunk_size
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.applied = 0
+        self._heap = []
+        self._queued = set()
+        self._loaded_until = None
+        self._generation = None
+        self._check_at = 0
+        self._wakeup = asyncio.Event()
+
+    def _push(self, reminder: Reminder):
+        key = reminder[1:]
+        if key in self._queued:
+            return
+        self._queued.add(key)
+        heapq.heappush(self._heap, reminder)
+        if self._heap[0] is reminder:
+            # Новое событие раньше текущего ближайшего — будим цикл
+            self._wakeup.set()
+
+    async def _load(self, until_ts: int):
+        now = int(time.time())
+        for action, offset, min_left in ACTIONS:
+            if self._loaded_until is None:
+                # Первая загрузка: всё пропущенное, но ещё актуальное
+                after_ts = None if min_left is None else now + min_left
+            else:
+                after_ts = self._loaded_until + offset
+            # Один индексный запрос сразу по всем каналам
+            rows = await self.db.get_subscriptions_ending(after_ts, until_ts + offset)
+            for user_id, channel, end_ts in rows:
+                self._push(Reminder(end_ts - offset, user_id, channel, action, end_ts))
+        self._loaded_until = until_ts
+        logger.info(f"Планировщик: загружены события до {until_ts}, в очереди {len(self._heap)}")
+
+    def schedule_subscription(self, user_id: int, channel: int, end_ts: int):
+        # Вызывается после продления подписки. События за пределами загруженного
+        # окна подтянутся из базы сами, здесь добавляем только попадающие в окно
+        if self._loaded_until is None:
+            return
+        now = int(time.time())
+        for action, offset, min_left in ACTIONS:
+            due_ts = end_ts - offset
+            if due_ts > self._loaded_until:
+                continue
+            if min_left is not None and end_ts - now <= min_left:
+                continue
+            self._push(Reminder(due_ts, user_id, channel, action, end_ts))
+
+    async def _check_generation(self, now: float):
+        generation = await self.db.get_generation(SUBSCRIPTIONS_GENERATION)
+        self._check_at = now + self.poll_interval
+        if generation == self._generation:
+            return
+        if self._generation is not None:
+            logger.info("Планировщик: подписки изменены массовой операцией, очередь собирается заново")
+        # Счётчик запоминается до загрузки: изменение во время загрузки вызовет ещё одну
+        self._generation = generation
+        self._heap.clear()
+        self._queued.clear()
+        self._loaded_until = None
+
+    async def _fire(self, reminders):
+        # Устаревшие события (подписку продлили или закрыли) и уже выполненные отсеивает база
+        rows = [(r.user_id, r.channel, r.action, r.end_ts, self.render(r)) for r in reminders]
+        try:
+            applied = await self.db.apply_reminders(rows, EXPIRE)
+        except BaseException:
+            # Пачка не записана: возвращаем события в очередь, чтобы выполнить их позже
+            for reminder in reminders:
+                self._push(reminder)
+            raise
+        self.applied += len(applied)
+        if not applied:
+            return
+        if self.outbox is not None:
+            self.outbox.wake()
+        if self.on_applied is not None:
+            by_key = {reminder[1:]: reminder for reminder in reminders}
+            try:
+                await self.on_applied([by_key[tuple(row)] for row in applied])
+            except Exception as e:
+                logger.error(f"Ошибка обработки выполненных событий: {e}")
+
+    async def run(self):
+        failures = 0
+        while True:
+            now = time.time()
+            try:
+                if now >= self._check_at:
+                    await self._check_generation(now)
+                if self._loaded_until is None or now + self.horizon / 2 >= self._loaded_until:
+                    await self._load(int(now) + self.horizon)
+                    failures = 0
+                    continue
+
+                if self._heap and self._heap[0].due_ts <= now:
+                    chunk = []
+                    while self._heap and self._heap[0].due_ts <= now and len(chunk) < self.chunk_size:
+                        reminder = heapq.heappop(self._heap)
+                        self._queued.discard(reminder[1:])
+                        chunk.append(reminder)
+                    await self._fire(chunk)
+                    failures = 0
+                    continue
+            except Exception as e:
+                # Невыполненные события уже вернулись в очередь, окно догрузится на следующем шаге
+                failures += 1
+                delay = min(2 ** failures, self.max_delay)
+                logger.error(f"Ошибка планировщика, повтор через {delay} с: {e}")
+                await asyncio.sleep(delay)
+                continue
+
+            # Спим до следующего события, подгрузки следующего окна или проверки счётчика
+            wake_at = min(self._loaded_until - self.horizon / 2, self._check_at)
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0].due_ts)
+            self._wakeup.clear()
+            # asyncio.wait, а не wait_for: см. AdminDigest._loop
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=max(wake_at - now, 0))
+            finally:
+                waiter.cancel()
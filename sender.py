@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage, TelegramMethod
+
+from metrics import SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else 1.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # Списывает токен и возвращает, сколько ждать до отведённого слота.
+        # Токены могут уйти в минус: так каждый запрос получает свой слот,
+        # и очередь к одному чату не просыпается вся разом
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def block(self, seconds: float):
+        # Telegram вернул 429: не тратим токены, пока не истечёт retry_after
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+@dataclass
+class OutboundJob:
+    method: TelegramMethod
+    chat_id: int
+    future: asyncio.Future
+    attempts: int = 0
+    chat_slot: bool = False
+    last_error: str = field(default=None)
+
+
+class OutboundSender:
+    """Очередь исходящих сообщений.
+
+    Ограничивает скорость отправки общим и поканальным token bucket,
+    выполняет отправку фиксированным числом воркеров, повторяет запросы
+    после 429 (с учётом retry_after) и сетевых ошибок, а сообщения,
+    которые так и не удалось доставить, сохраняет в dead_letters.
+    """
+
+    def __init__(self, bot: Bot, db, workers: int = 8, global_rate: float = 25,
+                 per_chat_rate: float = 1, max_attempts: int = 5):
+        self.bot = bot
+        self.db = db
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_attempts = max_attempts
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self.sent = 0
+        self.retried_429 = 0
+        self.dead = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        # Даём отправить уже поставленные в очередь сообщения
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не успели отправить {self._queue.qsize()} сообщений до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def send(self, method: TelegramMethod) -> asyncio.Future:
+        # Результат — отправленное сообщение или None, если оно ушло в dead_letters
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(OutboundJob(method, getattr(method, "chat_id", None), future))
+        return future
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        return self.send(SendMessage(chat_id=chat_id, text=text, **kwargs))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Убираем корзины давно молчавших чатов, чтобы словарь не рос бесконечно
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items()
+                    if now - value.updated < 60 or now < value.blocked_until
+                }
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.per_chat_rate)
+        return bucket
+
+    def _retry_later(self, job: OutboundJob, delay: float):
+        # Не держим воркер на ожидании: задача вернётся в очередь сама.
+        # task_done вызывается после повторной постановки, чтобы join не завершился раньше времени
+        def requeue():
+            self._queue.put_nowait(job)
+            self._queue.task_done()
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            chat_bucket = self._chat_bucket(job.chat_id) if job.chat_id is not None else None
+
+            # Поканальный лимит: если чат ещё «остывает», откладываем только эту задачу
+            if chat_bucket is not None and not job.chat_slot:
+                job.chat_slot = True
+                chat_delay = chat_bucket.reserve()
+                if chat_delay > 0:
+                    self._retry_later(job, chat_delay)
+                    continue
+            job.chat_slot = False
+
+            # Общий лимит: ждём свой слот
+            global_delay = self.global_bucket.reserve()
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+
+            await self._execute(job, chat_bucket)
+
+    async def _request(self, method: TelegramMethod):
+        started = time.perf_counter()
+        try:
+            return await self.bot(method)
+        finally:
+            SEND_SECONDS.observe(time.perf_counter() - started, method.__api_method__)
+
+    async def _execute(self, job: OutboundJob, chat_bucket: TokenBucket):
+        job.attempts += 1
+        try:
+            result = await self._request(job.method)
+        except TelegramRetryAfter as e:
+            self.retried_429 += 1
+            (chat_bucket or self.global_bucket).block(e.retry_after)
+            await self._fail_or_retry(job, str(e), e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            await self._fail_or_retry(job, str(e), min(2 ** job.attempts, 60))
+        except Exception as e:
+            # Остальные ошибки (бот заблокирован, неверный запрос) повторять бессмысленно
+            job.last_error = str(e)
+            await self._dead_letter(job)
+        else:
+            self.sent += 1
+            job.future.set_result(result)
+            self._queue.task_done()
+
+    async def _fail_or_retry(self, job: OutboundJob, error: str, delay: float):
+        job.last_error = error
+        if job.attempts >= self.max_attempts:
+            await self._dead_letter(job)
+            return
+        logger.warning(f"Повтор отправки в чат {job.chat_id} через {delay} с: {error}")
+        self._retry_later(job, delay)
+
+    async def _dead_letter(self, job: OutboundJob):
+        self.dead += 1
+        logger.error(f"Не удалось отправить сообщение в чат {job.chat_id}: {job.last_error}")
+        try:
+            await self.db.add_dead_letter(
+                job.chat_id,
+                job.method.__api_method__,
+                job.method.model_dump_json(exclude_none=True),
+                job.last_error,
+                job.attempts,
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сообщения в dead_letters: {e}")
+        job.future.set_result(None)
+        self._queue.task_done()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+
+from aiogram import Bot
+
+from update_processor import update_user_id
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(data: dict, shards: int) -> int:
+    # Все апдейты одного пользователя идут в один процесс: там его FSM-состояние
+    # и порядок шагов регистрации
+    user_id = update_user_id(data)
+    return (user_id if user_id is not None else data.get("update_id", 0)) % shards
+
+
+class ShardRouter:
+    """Распределение апдейтов по процессам-воркерам.
+
+    Супервизор получает апдейты (long polling или webhook) и кладёт их в
+    очередь процесса, выбранного по id пользователя. Упавший воркер
+    перезапускается с той же очередью, поэтому апдейты его пользователей
+    не теряются. Интерфейс feed() совпадает с UpdateProcessor, так что
+    роутер подключается к webhook-серверу через add_telegram_route.
+    """
+
+    def __init__(self, target, shards: int):
+        # target(queue, shards) — точка входа процесса-воркера
+        self.target = target
+        self.shards = shards
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue() for _ in range(shards)]
+        self._processes = [None] * shards
+        self._accepting = False
+        self._watch_task = None
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target, args=(self._queues[index], self.shards), name=f"bot-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+        self._accepting = True
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self._processes):
+                if self._accepting and not process.is_alive():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаем")
+                    self._spawn(index)
+
+    async def feed(self, data: dict) -> bool:
+        if not self._accepting:
+            return False
+        self._queues[shard_for(data, self.shards)].put(data)
+        return True
+
+    async def poll(self, bot: Bot, allowed_updates=None, timeout: int = 30):
+        # Long polling в супервизоре: апдейты не разбираются, а сразу уходят воркерам
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+            except Exception as e:
+                logger.error(f"Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                await self.feed(update.model_dump(mode="json", exclude_unset=True, by_alias=True))
+                offset = update.update_id + 1
+
+    async def drain(self, timeout: float = 60):
+        # Сигнал остановки идёт в очередь после уже принятых апдейтов:
+        # воркер дообработает их и завершится сам
+        self._accepting = False
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+        loop = asyncio.get_running_loop()
+        for index, process in enumerate(self._processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не завершился за {timeout} с, останавливаем принудительно")
+                process.terminate()
+
+
+def _next_update(shard_queue):
+    # None — сигнал остановки; супервизор мог и упасть, тогда тоже завершаемся
+    while True:
+        try:
+            return shard_queue.get(timeout=1)
+        except queue.Empty:
+            parent = multiprocessing.parent_process()
+            if parent is not None and not parent.is_alive():
+                return None
+
+
+async def consume(shard_queue, update_processor):
+    # Апдейты передаются в UpdateProcessor строго по очереди, порядок сохраняется
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, _next_update, shard_queue)
+        if data is None:
+            return
+        await update_processor.feed(data)
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+def update_user_id(data: dict):
+    # id отправителя из «сырого» апдейта: message.from, callback_query.from и т.д.
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+    return None
+
+
+class UpdateProcessor:
+    """Обработка входящих апдейтов фиксированным числом воркеров.
+
+    Апдейты одного пользователя всегда попадают к одному воркеру, поэтому
+    шаги регистрации выполняются по порядку. Очереди ограничены: при
+    перегрузке feed() ждёт, и Telegram сам повторит доставку позже.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = 32, queue_size: int = 100):
+        self.dp = dp
+        self.bot = bot
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks = []
+        self._accepting = True
+
+    def start(self):
+        if not self._tasks:
+            self._accepting = True
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def feed(self, data: dict) -> bool:
+        if not self._accepting:
+            return False
+        user_id = update_user_id(data)
+        queue = self._queues[hash(user_id if user_id is not None else data.get("update_id")) % len(self._queues)]
+        await queue.put(data)
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            data = await queue.get()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {data.get('update_id')}: {e}")
+            finally:
+                queue.task_done()
+
+    async def drain(self, timeout: float = 30):
+        # Перестаём принимать новые апдейты и дожидаемся уже принятых
+        self._accepting = False
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            left = sum(queue.qsize() for queue in self._queues)
+            logger.warning(f"Не успели обработать {left} апдейтов до остановки")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
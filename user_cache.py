@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    """LRU-кэш пользователей с ограничением по времени жизни.
+
+    Для каждого пользователя хранится строка users и список подписок; любую
+    из частей можно закэшировать или сбросить отдельно. Database обновляет
+    кэш при каждой записи (write-through), поэтому устаревшие данные
+    возможны только при изменении базы в обход Database — для этого есть
+    invalidate() и clear().
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # user_id -> [истекает в, строка users или None, подписки или None]
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Растёт при каждой записи: результат чтения, начатого до записи,
+        # в кэш не кладём, чтобы не затереть свежие данные старыми
+        self.generation = 0
+
+    def _entry(self, user_id: int):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _get(self, user_id: int, part: int):
+        entry = self._entry(user_id)
+        value = entry[part] if entry is not None else None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _put(self, user_id: int, part: int, value, generation: int = None):
+        # generation=None — данные только что записаны в базу; иначе это
+        # результат чтения, и он годится, только если с его начала записей не было
+        if generation is None:
+            self.generation += 1
+        elif generation != self.generation:
+            return
+        if self.maxsize <= 0:
+            return
+        entry = self._entry(user_id)
+        if entry is None:
+            entry = self._entries[user_id] = [0, None, None]
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        entry[0] = time.monotonic() + self.ttl
+        entry[part] = value
+
+    def get_user(self, user_id: int):
+        return self._get(user_id, 1)
+
+    def put_user(self, user, generation: int = None):
+        self._put(user[0], 1, user, generation)
+
+    def get_subscriptions(self, user_id: int):
+        subscriptions = self._get(user_id, 2)
+        return list(subscriptions) if subscriptions is not None else None
+
+    def put_subscriptions(self, user_id: int, subscriptions, generation: int = None):
+        self._put(user_id, 2, tuple(subscriptions), generation)
+
+    def invalidate_subscriptions(self, user_id: int):
+        self.generation += 1
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            entry[2] = None
+
+    def invalidate(self, user_id: int):
+        self.generation += 1
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
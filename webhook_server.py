@@ -1,9 +1,16 @@
-from flask import Flask, request, jsonify
+from aiohttp import web
+from decimal import Decimal
+import asyncio
 import hmac
 import hashlib
+import json
 import logging
-
-app = Flask(__name__)
+import ssl
+import time
+import config
+from metrics import REGISTRY, WEBHOOK_SECONDS, YOOKASSA_EVENTS
+from database import payload_channel
+from replay_cache import ReplayCache
 
 # Секретный ключ из настроек ЮКассы
 YOOKASSA_SECRET_KEY = ''
@@ -12,51 +19,334 @@ YOOKASSA_SECRET_KEY = ''
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    # Получаем данные из запроса
-    data = request.json
-    signature = request.headers.get('Yookassa-Signature')
+# Сколько секунд при остановке ждать обработки уже принятых уведомлений
+PAYMENT_DRAIN_TIMEOUT = 30
+# Сколько уведомлений из inbox обрабатывается за проход и как часто проверяются отложенные повторы
+INBOX_BATCH = 100
+INBOX_POLL_INTERVAL = 10
+
+OK_BODY = b'{"status": "ok"}'
+
+routes = web.RouteTableDef()
+
+@routes.post('/webhook')
+async def webhook(request: web.Request):
+    app = request.app
+    # Слишком большое тело не дочитываем: ни подпись, ни JSON по нему не считаются
+    body = await read_body(request, app['max_body'])
+    if body is None:
+        YOOKASSA_EVENTS.inc('too_large')
+        response = web.json_response({"error": "Request body too large"}, status=413)
+        # Остаток тела aiohttp дочитает и выбросит, а соединение после ответа закроет
+        response.force_close()
+        return response
 
-    # Проверяем подпись
-    if not verify_signature(data, signature):
+    # Подпись проверяется по «сырому» телу до разбора JSON
+    if not verify_signature(body, request.headers.get('Yookassa-Signature')):
+        YOOKASSA_EVENTS.inc('invalid_signature')
         logger.error("Неверная подпись запроса")
-        return jsonify({"error": "Invalid signature"}), 400
-
-    # Обрабатываем событие
-    event_type = data['event']
-    if event_type == 'payment.succeeded':
-        payment_data = data['object']
-        handle_payment_success(payment_data)
-    elif event_type == 'payment.canceled':
-        payment_data = data['object']
-        handle_payment_canceled(payment_data)
-
-    return jsonify({"status": "ok"}), 200
-
-def verify_signature(data, signature):
-    # Генерируем подпись
-    message = f"{data['event']}.{data['object']['id']}"
-    generated_signature = hmac.new(
-        YOOKASSA_SECRET_KEY.encode(),
-        message.encode(),
-        hashlib.sha256
-    ).hexdigest()
+        return web.json_response({"error": "Invalid signature"}, status=400)
+
+    event = parse_event(body)
+    if event is None:
+        YOOKASSA_EVENTS.inc('malformed')
+        logger.error("Некорректное уведомление ЮКассы")
+        return web.json_response({"error": "Malformed notification"}, status=400)
+    event_type, payment_data = event
+
+    # Повтор уже принятого уведомления: отвечаем 200, чтобы ЮКасса перестала его слать
+    key = f"{event_type}.{payment_data['id']}"
+    replays = app['replay_cache']
+    if replays.seen(key):
+        YOOKASSA_EVENTS.inc('replay')
+        return web.Response(body=OK_BODY, content_type='application/json')
+
+    # До ответа уведомление только записывается в inbox; платёж обрабатывается в фоне
+    # с повторами, поэтому после 200 он не теряется ни при ошибке, ни при остановке процесса
+    if event_type in PAYMENT_HANDLERS:
+        db = app['db']
+        if db is None:
+            # Без базы (локальная проверка сервера) платёж только пишется в лог
+            try:
+                await PAYMENT_HANDLERS[event_type](app, payment_data)
+            except Exception as e:
+                logger.error(f"Ошибка обработки уведомления {key}: {e}")
+        else:
+            try:
+                await store_webhook_event(app, event_type, payment_data['id'], body)
+            except Exception as e:
+                # Не запоминаем уведомление: ЮКасса повторит его доставку
+                YOOKASSA_EVENTS.inc('unavailable')
+                logger.error(f"Не удалось сохранить уведомление {key}: {e}")
+                return web.json_response({"error": "Temporarily unavailable"}, status=503)
+            app['inbox_wakeup'].set()
+        replays.add(key)
+    YOOKASSA_EVENTS.inc('accepted')
+    return web.Response(body=OK_BODY, content_type='application/json')
+
+async def read_body(request: web.Request, limit: int):
+    # None, если тело больше limit; по Content-Length — не читая его вовсе
+    if request.content_length is not None and request.content_length > limit:
+        return None
+    chunks = []
+    size = 0
+    while True:
+        chunk = await request.content.readany()
+        if not chunk:
+            return b''.join(chunks)
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+
+def verify_signature(body: bytes, signature):
+    if not signature:
+        return False
+
+    # HMAC-SHA256 от тела запроса целиком
+    generated_signature = hmac.new(YOOKASSA_SECRET_KEY.encode(), body, hashlib.sha256).hexdigest()
 
     # Сравниваем подписи
     return hmac.compare_digest(generated_signature, signature)
 
-def handle_payment_success(payment_data):
+def parse_event(body: bytes):
+    # (тип события, объект платежа) или None, если уведомление не той структуры
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    event_type = data.get('event')
+    payment_data = data.get('object')
+    if not isinstance(event_type, str) or not isinstance(payment_data, dict) or not isinstance(payment_data.get('id'), str):
+        return None
+    return event_type, payment_data
+
+async def handle_payment_success(app: web.Application, payment_data):
     # Логика обработки успешного платежа
     user_id = payment_data['metadata'].get('user_id')  # Если вы передали user_id в метаданных
+    payload = payment_data['metadata'].get('payload')  # Например, subscription_channel_1
     amount = payment_data['amount']['value']
     currency = payment_data['amount']['currency']
     logger.info(f"Пользователь {user_id} успешно оплатил {amount} {currency}.")
 
-def handle_payment_canceled(payment_data):
+    db = app.get('db')
+    if db is None or not user_id:
+        return
+
+    # ЮКасса повторяет доставку, пока не получит 200: дубликат отсекается по id платежа
+    result = await db.record_payment(
+        'yookassa', payment_data['id'], int(user_id), payload, int(Decimal(amount) * 100), currency
+    )
+    if result is None:
+        logger.info(f"Платеж {payment_data['id']} уже обработан, повтор пропущен")
+        return
+    payment_date, new_subscription_end, _ = result
+
+    digest = app.get('digest')
+    if digest is not None:
+        await digest.add_payment(int(user_id), payload_channel(payload), int(Decimal(amount) * 100), currency, payment_date)
+
+    text = f"Платёж на сумму {amount} {currency} получен. Спасибо!"
+    if new_subscription_end:
+        text += f" Подписка продлена до {new_subscription_end}."
+    # Через общую очередь отправки: она соблюдает лимиты Telegram и повторяет при 429
+    sender = app.get('sender')
+    if sender is not None:
+        sender.send_message(int(user_id), text)
+        return
+    # Без очереди (супервизор при WORKER_PROCESSES > 1) пишем пользователю напрямую
+    bot = app.get('bot')
+    if bot is not None:
+        try:
+            await bot.send_message(int(user_id), text)
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления пользователю {user_id}: {e}")
+
+async def handle_payment_canceled(app: web.Application, payment_data):
     # Логика обработки отмененного платежа
     user_id = payment_data['metadata'].get('user_id')
     logger.info(f"Платеж пользователя {user_id} отменен.")
 
+PAYMENT_HANDLERS = {
+    'payment.succeeded': handle_payment_success,
+    'payment.canceled': handle_payment_canceled,
+}
+
+# Запись в inbox: уведомления, пришедшие, пока идёт предыдущая запись, сохраняются
+# следующей одной транзакцией, а не каждое своей
+async def store_webhook_event(app: web.Application, event_type: str, object_id: str, body: bytes):
+    future = asyncio.get_running_loop().create_future()
+    app['inbox_pending'].append(((event_type, object_id, body), future))
+    if app['inbox_writer'] is None:
+        app['inbox_writer'] = asyncio.create_task(write_inbox(app))
+    await future
+
+async def write_inbox(app: web.Application):
+    pending = app['inbox_pending']
+    try:
+        while pending:
+            batch = pending[:]
+            pending.clear()
+            try:
+                await app['db'].add_webhook_events([event for event, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+    finally:
+        app['inbox_writer'] = None
+
+# Фоновая обработка уведомлений из inbox
+async def process_webhook_event(app: web.Application, semaphore: asyncio.Semaphore, event_id: int, event_type: str,
+                                body: bytes, attempts: int):
+    # (id, статус, попыток, когда повторить, ошибка) для save_webhook_results
+    async with semaphore:
+        attempts += 1
+        try:
+            _, payment_data = parse_event(body)
+            await PAYMENT_HANDLERS[event_type](app, payment_data)
+            return event_id, 'done', attempts, 0, None
+        except Exception as e:
+            error = str(e)
+    # Повторная обработка безопасна: уже записанный платёж отсекается по его id
+    if attempts >= app['payment_attempts']:
+        logger.error(f"Уведомление {event_type} #{event_id} не обработано после {attempts} попыток: {error}")
+        return event_id, 'failed', attempts, 0, error
+    delay = min(2 ** attempts * 5, 60 * 60)
+    logger.error(f"Ошибка обработки уведомления {event_type} #{event_id}, повтор через {delay} с: {error}")
+    return event_id, 'pending', attempts, int(time.time()) + delay, error
+
+async def process_inbox(app: web.Application) -> int:
+    db = app['db']
+    rows = await db.get_due_webhook_events(INBOX_BATCH)
+    if not rows:
+        return 0
+    semaphore = asyncio.Semaphore(app['payment_workers'])
+    results = await asyncio.gather(*(process_webhook_event(app, semaphore, *row) for row in rows))
+    # Результаты всей пачки — одной транзакцией
+    await db.save_webhook_results(results)
+    return len(results)
+
+async def inbox_worker(app: web.Application):
+    wakeup = app['inbox_wakeup']
+    while True:
+        wakeup.clear()
+        try:
+            if await process_inbox(app):
+                continue
+        except Exception as e:
+            logger.error(f"Ошибка обработки inbox уведомлений ЮКассы: {e}")
+        if app['inbox_stopping']:
+            return
+        # Новые уведомления будят сразу, отложенные повторы подбираются по таймауту
+        waiter = asyncio.ensure_future(wakeup.wait())
+        try:
+            await asyncio.wait([waiter], timeout=INBOX_POLL_INTERVAL)
+        finally:
+            waiter.cancel()
+
+async def start_payment_workers(app: web.Application):
+    # Уведомления, не обработанные до прошлой остановки, подхватываются сразу
+    if app['db'] is not None:
+        app['inbox_task'] = asyncio.create_task(inbox_worker(app))
+
+async def stop_payment_workers(app: web.Application):
+    # Сервер уже не принимает запросы: дообрабатываем записанные уведомления,
+    # а не успевшие останутся в inbox до следующего запуска
+    task = app.get('inbox_task')
+    if task is None:
+        return
+    app['inbox_stopping'] = True
+    app['inbox_wakeup'].set()
+    try:
+        await asyncio.wait_for(asyncio.shield(task), PAYMENT_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Не успели обработать уведомления ЮКассы до остановки, они останутся в inbox")
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+# Приём апдейтов Telegram в режиме webhook
+async def telegram_webhook(request: web.Request):
+    secret = request.app['telegram_secret']
+    if secret and not hmac.compare_digest(request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret):
+        return web.json_response({"error": "Invalid secret token"}, status=401)
+
+    data = await request.json()
+    # Апдейт ставится в очередь, ответ Telegram отдаём сразу
+    if not await request.app['update_processor'].feed(data):
+        return web.json_response({"error": "Shutting down"}, status=503)
+    return web.json_response({"status": "ok"})
+
+# Метрики в формате Prometheus
+@routes.get('/metrics')
+async def metrics(request: web.Request):
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+# Время обработки каждого запроса; путь берётся из маршрута, чтобы случайные URL не плодили метки
+@web.middleware
+async def metrics_middleware(request: web.Request, handler):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        path = resource.canonical if resource is not None else 'unmatched'
+        WEBHOOK_SECONDS.observe(time.perf_counter() - started, path, status)
+
+def add_telegram_route(app: web.Application, update_processor, path: str, secret_token: str = ''):
+    app['update_processor'] = update_processor
+    app['telegram_secret'] = secret_token
+    app.router.add_post(path, telegram_webhook)
+
+# Создание приложения; bot, db, сводка для администраторов и очередь отправки общие с ботом
+def create_app(bot=None, db=None, digest=None, sender=None) -> web.Application:
+    app = web.Application(middlewares=[metrics_middleware])
+    app['bot'] = bot
+    app['sender'] = sender
+    app['db'] = db
+    app['digest'] = digest
+    app['max_body'] = config.YOOKASSA_MAX_BODY
+    app['replay_cache'] = ReplayCache(config.YOOKASSA_REPLAY_CACHE_SIZE, config.YOOKASSA_REPLAY_WINDOW)
+    app['payment_workers'] = config.YOOKASSA_WORKERS
+    app['payment_attempts'] = config.YOOKASSA_MAX_ATTEMPTS
+    app['inbox_pending'] = []
+    app['inbox_writer'] = None
+    app['inbox_wakeup'] = asyncio.Event()
+    app['inbox_stopping'] = False
+    app['inbox_task'] = None
+    app.on_startup.append(start_payment_workers)
+    app.on_cleanup.append(stop_payment_workers)
+    app.add_routes(routes)
+    return app
+
+def create_ssl_context(cert_path: str, key_path: str):
+    # Сертификат загружается из файлов, а не генерируется при каждом запуске
+    if not cert_path or not key_path:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+# Запуск сервера внутри уже работающего event loop
+async def start_webhook_server(app: web.Application, host: str = '0.0.0.0', port: int = 5000, ssl_context=None):
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+    await site.start()
+    logger.info(f"Webhook-сервер запущен на {host}:{port}")
+    return runner
+
 if __name__ == '__main__':
-    app.run(port=5000, ssl_context='adhoc')  # Запуск с самоподписанным SSL-сертификатом
\ No newline at end of file
+    web.run_app(create_app(), port=5000)
\ No newline at end of file